@@ -6,16 +6,40 @@ Created on Mon Jan 23 09:59:05 2023
 """
 import sys
 import os
+import argparse
 import logging
 from logging.handlers import QueueHandler
 import multiprocessing
 from PyQt5.QtWidgets import QApplication
 import erya_gui
 import erya_logger
+import erya_export
+import erya_profiler
+import erya_transport
 
 if __name__ == '__main__':
+    #Command line options, anything unknown is left for Qt
+    parser = argparse.ArgumentParser(description="ERYA Tool")
+    parser.add_argument("--batch", metavar="CONFIG",
+        help="headless mode, writes one report per site listed in CONFIG (JSON)")
+    parser.add_argument("--output", default=os.getcwd(),
+        help="batch reports directory")
+    parser.add_argument("--format", default="xlsx",
+        choices=list(erya_export.EXPORT_FORMATS.values()), help="batch reports format")
+    parser.add_argument("--series", action="store_true",
+        help="include time series in batch reports")
+    parser.add_argument("--profile", action="store_true",
+        help="write cProfile/tracemalloc reports of GUI actions and batch runs in log folder")
+    args, qt_args = parser.parse_known_args()
+    if args.profile:
+        erya_profiler.enable_profiling()
+
     #Starts the app
-    app = QApplication(sys.argv)
+    if args.batch is None:
+        app = QApplication(sys.argv[:1] + qt_args)
+
+    #Shared memory blocks must be tracked by the main process only (POSIX)
+    erya_transport.start_resource_tracker()
 
     #Multiprocessing shared queue for logging
     log_queue = multiprocessing.Queue()
@@ -38,6 +62,9 @@ if __name__ == '__main__':
 
     #Ensures the logger is created properly
     error_message = log_error_queue.get(block=True, timeout=10)
+    if (error_message != "OK") and (args.batch is not None):
+        print("The program was unable to start the main logger", file=sys.stderr)
+        sys.exit()
     if error_message == "Error":
         erya_gui.error_window("Error when creating logger",
             "The program was unable to start the main logger")
@@ -47,11 +74,24 @@ if __name__ == '__main__':
         logger.info("ERYA Tool® V0.1")
         logger.info("Main process PID %s",os.getpid())
         logger.info("Logger process PID %s",logger_process.pid)
+        if erya_profiler.profiling_enabled():
+            logger.info("Profiling enabled, reports will be written in log folder")
     else:
         erya_gui.error_window("Timeout when creating logger",
             "The program was unable to start the main logger (Timeout)")
         sys.exit()
     
+    #Headless batch export, no window is created
+    if args.batch is not None:
+        try:
+            erya_export.export_batch(args.batch, args.output, args.format,
+                logger, args.series)
+        except (OSError, ValueError, KeyError, ImportError) as err:
+            logger.error("Batch export failed: %s", err)
+        log_queue.put(None)
+        logger_process.join(5)
+        sys.exit()
+
     #Starts the main window
     window = erya_gui.MainWindow(log_queue, logger_process, logger)
     window.show()
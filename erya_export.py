@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+Export module
+"""
+import os
+import re
+import json
+import logging
+from logging.handlers import QueueHandler
+import pandas as pd
+import erya_resource as eryaR
+import erya_transport as eryaTr
+from erya_profiler import profiled
+
+EXPORT_FORMATS = {"CSV": "csv", "Parquet": "parquet", "Excel": "xlsx"}
+CHUNK_SIZE = 50000
+EXCEL_MAX_ROWS = 1048575
+
+def build_monthly_comparison(dataframes: dict):
+    """
+    Builds the monthly comparison table from the monthly averages of each source.
+
+    Parameters
+    ----------
+    dataframes : dict
+        Source label as key and monthly averages dataframe as value.
+
+    Returns
+    -------
+    pd.DataFrame
+        One column per variable and source, named "<variable> (<source>)".
+
+    """
+    df_comparison = pd.DataFrame()
+    for label, df_ma in dataframes.items():
+        df_ma = df_ma.apply(pd.to_numeric, errors="coerce")
+        for variable in ["GHI", "DHI", "DNI", "TEMP", "WS"]:
+            if variable in df_ma.columns:
+                df_comparison[variable+" ("+label+")"] = df_ma[variable]
+    return df_comparison[sorted(df_comparison.columns, key=lambda column:
+        ["GHI", "DHI", "DNI", "TEMP", "WS"].index(column.split(" ")[0]))]
+
+def export_results(output_dir: str, basename: str, monthly: dict, series: dict,
+        fmt: str, logger: logging.Logger, chunk_size: int = CHUNK_SIZE):
+    """
+    Exports the monthly comparison and the time series of every source.
+
+    Parameters
+    ----------
+    output_dir : str
+        Directory where files are written.
+    basename : str
+        Prefix for every file written.
+    monthly : dict
+        Source label as key and monthly averages dataframe as value.
+    series : dict
+        Source label as key and time series dataframe as value.
+    fmt : str
+        File extension, one of EXPORT_FORMATS values.
+    logger : logging.Logger
+        Logger.
+    chunk_size : int, optional
+        Rows written per chunk for time series. The default is CHUNK_SIZE.
+
+    Returns
+    -------
+    list
+        Paths of the files written.
+
+    """
+    if fmt not in EXPORT_FORMATS.values():
+        raise ValueError("Unknown export format "+str(fmt))
+    os.makedirs(output_dir, exist_ok=True)
+    basename = _safe_name(basename)
+    df_comparison = build_monthly_comparison(monthly)
+    series = {label: df for label, df in series.items() if df is not None}
+    written = []
+
+    if fmt == "xlsx":
+        #Single workbook, one sheet per table, rows streamed to disk
+        filepath = os.path.join(output_dir, basename+".xlsx")
+        sheets = {"Comparison": df_comparison}
+        sheets.update({"MA "+label: df for label, df in monthly.items()})
+        sheets.update({"TS "+label: df for label, df in series.items()})
+        _write_excel_chunks(filepath, sheets, chunk_size)
+        written.append(filepath)
+    else:
+        filepath = os.path.join(output_dir, basename+"_comparison."+fmt)
+        _write_chunks(filepath, df_comparison, fmt, chunk_size)
+        written.append(filepath)
+        for label, df_series in series.items():
+            filepath = os.path.join(output_dir, basename+"_"+_safe_name(label)+"."+fmt)
+            _write_chunks(filepath, df_series, fmt, chunk_size)
+            written.append(filepath)
+    for filepath in written:
+        logger.info("Exported %s", filepath)
+    return written
+
+def export_subprocess(log_queue: QueueHandler, output_dir: str, basename: str,
+        monthly: dict, series_handles: dict, fmt: str):
+    """
+    Export subprocess so the GUI is not blocked while files are written.
+
+    Parameters
+    ----------
+    log_queue : logging.QueueHandler()
+        Shared logging queue.
+    series_handles : dict
+        Source label as key and shared memory handle of its time series as value.
+    output_dir, basename, monthly, fmt :
+        See export_results.
+
+    Returns
+    -------
+    None.
+
+    """
+    logger = logging.getLogger("ERYA_export")
+    if logger.hasHandlers():
+        logger.handlers.clear()
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.info("Export process PID %s", os.getpid())
+    series = {}
+    blocks = []
+    try:
+        #Time series are read in place from the GUI shared memory blocks
+        for label, handle in series_handles.items():
+            if handle is not None:
+                series[label], block = eryaTr.attach_series(handle)
+                blocks.append(block)
+        export_results(output_dir, basename, monthly, series, fmt, logger)
+        logger.info("Export finished in %s", output_dir)
+    except ImportError as err:
+        logger.error("Missing library for %s export: %s", fmt, err)
+    except (OSError, ValueError, TypeError) as err:
+        logger.error("Export to %s failed: %s", output_dir, err)
+    finally:
+        series.clear()
+        for block in blocks:
+            eryaTr.release_block(block, unlink=False)
+
+@profiled
+def export_batch(config_path: str, output_dir: str, fmt: str,
+        logger: logging.Logger, include_series: bool = False):
+    """
+    Headless export writing one report per site.
+
+    The configuration file is a JSON file with the following structure:
+    {"sites": [{"name": "...", "latitude": 0, "longitude": 0, "altitude": 0,
+                "sources": [{"type": "Solargis - TMY", "file": "path"}]}]}
+
+    Parameters
+    ----------
+    config_path : str
+        Batch configuration file path.
+    output_dir : str
+        Directory where reports are written.
+    fmt : str
+        File extension, one of EXPORT_FORMATS values.
+    logger : logging.Logger
+        Logger.
+    include_series : bool, optional
+        Also exports the time series of each source. The default is False.
+
+    Returns
+    -------
+    list
+        Paths of the files written.
+
+    """
+    with open(config_path, encoding="utf-8") as config_file:
+        config = json.load(config_file)
+    written = []
+    for site in config["sites"]:
+        monthly = {}
+        series = {}
+        for i, source in enumerate(site["sources"]):
+            label = str(i+1)+" - "+source["type"]
+            try:
+                monthly[label], series[label] = eryaR.read_solar_data_file(
+                    source.get("file", "NoFile"), source["type"], logger,
+                    site.get("latitude"), site.get("longitude"),
+                    site.get("altitude"), keep_series=True)
+            except (TypeError, OSError, ConnectionError, pd.errors.EmptyDataError):
+                logger.error("Source %s skipped for site %s", label, site["name"])
+        if not monthly:
+            logger.error("No data loaded for site %s, report not written", site["name"])
+            continue
+        written += export_results(os.path.join(output_dir, _safe_name(site["name"])),
+            site["name"], monthly, series if include_series else {}, fmt, logger)
+    return written
+
+def _iter_chunks(df_data: pd.DataFrame, chunk_size: int):
+    #Slices are views of the original data, nothing is concatenated
+    for start in range(0, max(len(df_data), 1), chunk_size):
+        yield df_data.iloc[start:start+chunk_size]
+
+def _write_chunks(filepath: str, df_data: pd.DataFrame, fmt: str, chunk_size: int):
+    if fmt == "csv":
+        _write_csv_chunks(filepath, df_data, chunk_size)
+    elif fmt == "parquet":
+        _write_parquet_chunks(filepath, df_data, chunk_size)
+    else:
+        _write_excel_chunks(filepath, {"Data": df_data}, chunk_size)
+
+def _write_csv_chunks(filepath: str, df_data: pd.DataFrame, chunk_size: int):
+    with open(filepath, "w", encoding="utf-8", newline="") as csv_file:
+        for i, chunk in enumerate(_iter_chunks(df_data, chunk_size)):
+            chunk.to_csv(csv_file, header=(i == 0))
+
+def _write_parquet_chunks(filepath: str, df_data: pd.DataFrame, chunk_size: int):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer = None
+    try:
+        #One row group per chunk, schema fixed by the first one
+        for chunk in _iter_chunks(df_data, chunk_size):
+            table = pa.Table.from_pandas(chunk, preserve_index=True,
+                schema=None if writer is None else writer.schema)
+            if writer is None:
+                writer = pq.ParquetWriter(filepath, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+def _write_excel_chunks(filepath: str, sheets: dict, chunk_size: int):
+    from openpyxl import Workbook
+    #Write-only workbooks stream rows to disk instead of keeping them in memory
+    workbook = Workbook(write_only=True)
+    for sheet_name, df_data in sheets.items():
+        sheet_name = _safe_sheet_name(sheet_name)
+        sheet = workbook.create_sheet(sheet_name)
+        sheet.append([df_data.index.name or ""] + [str(column) for column in df_data.columns])
+        rows, part = 0, 1
+        for chunk in _iter_chunks(df_data, chunk_size):
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            for row in chunk.itertuples(index=True, name=None):
+                #Excel sheets are limited in rows, continue in a new sheet
+                if rows == EXCEL_MAX_ROWS:
+                    part += 1
+                    rows = 0
+                    sheet = workbook.create_sheet(_safe_sheet_name(
+                        sheet_name[:27]+" ("+str(part)+")"))
+                    sheet.append([df_data.index.name or ""] +
+                        [str(column) for column in df_data.columns])
+                sheet.append(list(row))
+                rows += 1
+    workbook.save(filepath)
+
+def _safe_name(name: str):
+    return re.sub(r"[^\w\-]+", "_", str(name)).strip("_")
+
+def _safe_sheet_name(name: str):
+    return re.sub(r"[\[\]\:\*\?\/\\]", "_", str(name))[:31]
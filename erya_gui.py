@@ -3,15 +3,40 @@
 GUI classes and methods.
 """
 import os
+import queue
+import itertools
 import logging
 from logging.handlers import QueueHandler
 import multiprocessing
 from PyQt5.QtWidgets import QPushButton, \
     QMainWindow, QDialog, QFileDialog, QMessageBox, QLabel, QHBoxLayout, \
-    QWidget, QComboBox, QGridLayout, QCheckBox, QVBoxLayout, QLineEdit
-from PyQt5.QtCore import QDir
+    QWidget, QComboBox, QGridLayout, QCheckBox, QVBoxLayout, QLineEdit, QInputDialog
+from PyQt5.QtCore import QDir, QTimer
 import pandas as pd
 import erya_resource as eryaR
+import erya_transport as eryaTr
+import erya_export as eryaE
+import erya_solar as eryaS
+import erya_timegrid as eryaT
+import erya_uncertainty as eryaU
+import erya_project as eryaP
+import erya_mcp as eryaM
+from erya_profiler import profiled
+
+LOAD_ERRORS = {
+    "TypeError": ("Incorrect format file. Please check file contents", "Format error"),
+    "FileNotFoundError": ("The program was unable to select or load the data file",
+        "File error"),
+    "ConnectionError": ("The program was unable to connect to external API",
+        "Connection error"),
+    "OSError": ("Incorrect format file. Please check file contents", "OS Error"),
+    "ProjectError": ("The project file was moved or modified. Please load the source again",
+        "Project error")}
+#Load requests are numbered across every resource window, as they share the queue
+LOAD_REQUEST_NUMBERS = itertools.count(1)
+#Handover events of the pending load requests, shared as well so any window can
+#acknowledge (and free) a result whose window was reset or closed
+PENDING_HANDOVERS = {}
 
 class MainWindow(QMainWindow):
     """
@@ -47,6 +72,9 @@ class MainWindow(QMainWindow):
         #Additional windows
         self.resource_window = None
 
+        #Project opened from file, its datasets are read when first needed
+        self.project = None
+
         #Logging object that will be used by class methods
         self.log_queue = log_queue
         self.log_process = log_process
@@ -95,7 +123,8 @@ class MainWindow(QMainWindow):
         
     def fill_tools_layout(self):
         self.resource_button = QPushButton("Resource Analysis", self)
-        self.resource_button.clicked.connect(self.resource_button_clicked)
+        #Lambda so the "checked" signal argument never reaches the (wrapped) slot
+        self.resource_button.clicked.connect(lambda: self.resource_button_clicked())
         
         self.string_button = QPushButton("String length calc", self)
         self.site_button = QPushButton("Site description", self)
@@ -112,13 +141,62 @@ class MainWindow(QMainWindow):
         self.reset_button = QPushButton("Reset inputs")
         self.utilities_layout.addWidget(self.reset_button)
         self.reset_button.clicked.connect(self.reset_button_clicked)
-        
+        self.save_project_button = QPushButton("Save project")
+        self.utilities_layout.addWidget(self.save_project_button)
+        self.save_project_button.clicked.connect(self.save_project_button_clicked)
+        self.open_project_button = QPushButton("Open project")
+        self.utilities_layout.addWidget(self.open_project_button)
+        self.open_project_button.clicked.connect(self.open_project_button_clicked)
+
+    def save_project_button_clicked(self):
+        filepath = file_dialog(os.getcwd(), for_open=False, fmt=eryaP.PROJECT_EXTENSION)
+        if filepath == "":
+            return
+        project = self.project if self.project is not None else eryaP.PVProject()
+        project.name = self.name_qline.text()
+        project.project_bd_code = self.code_qline.text()
+        project.site.coord.update({"latitude": self.lat_qline.text(),
+            "longitude": self.lon_qline.text(), "altitude": self.alt_qline.text()})
+        if self.resource_window is not None:
+            project.solardata.slots = self.resource_window.slots_data()
+        try:
+            eryaP.save_project(project, filepath, self.logger)
+            #Reopened lazily so the project does not keep the slot data alive
+            self.project = eryaP.load_project(filepath, self.logger)
+        except (OSError, TypeError):
+            error_window("Error", "The program was unable to save the project file")
+
+    def open_project_button_clicked(self):
+        filepath = file_dialog(os.getcwd(), fmt=eryaP.PROJECT_EXTENSION)
+        if filepath == "":
+            return
+        try:
+            project = eryaP.load_project(filepath, self.logger)
+        except FileNotFoundError:
+            error_window("Error", "The program was unable to find the project file")
+            return
+        except TypeError:
+            error_window("Error", "Incorrect project file. Please check file contents")
+            return
+        self.reset_button_clicked()
+        self.project = project
+        self.name_qline.setText(project.name or "")
+        self.code_qline.setText(project.project_bd_code or "")
+        self.lat_qline.setText(str(project.site.coord["latitude"] or ""))
+        self.lon_qline.setText(str(project.site.coord["longitude"] or ""))
+        self.alt_qline.setText(str(project.site.coord["altitude"] or ""))
+
+    @profiled
     def resource_button_clicked(self):
         try:
             if (self.resource_window is None) and (self.check_resource_inputs() is True):
                 self.make_inputs_non_editable()
-                self.resource_window = ResourceWindow(self.logger, {"latitude": self.lat_qline.text(),
-                    "longitude": self.lon_qline.text(),"altitude": self.alt_qline.text()})
+                self.resource_window = ResourceWindow(self.logger, self.log_queue,
+                    self.comm_queue,
+                    {"name": self.name_qline.text(), "code": self.code_qline.text(),
+                    "latitude": self.lat_qline.text(),
+                    "longitude": self.lon_qline.text(),"altitude": self.alt_qline.text()},
+                    None if self.project is None else self.project.solardata.slots)
                 self.resource_window.show()
             elif (self.resource_window is not None) and (self.check_resource_inputs() is True):
                 self.resource_window.show()
@@ -168,8 +246,12 @@ class MainWindow(QMainWindow):
         self.lon_qline.setReadOnly(False)
         self.alt_qline.setReadOnly(False)
         if self.resource_window is not None:
+            self.resource_window.release_shared_memory()
             self.resource_window.deleteLater()
             self.resource_window = None
+        #Site may change, cached solar geometry and project datasets are no longer valid
+        self.project = None
+        eryaS.clear_geometry_cache()
     
 
     def closeEvent(self,event):
@@ -186,6 +268,10 @@ class MainWindow(QMainWindow):
         None.
 
         """
+        #Shared memory blocks are freed before leaving
+        if self.resource_window is not None:
+            self.resource_window.release_shared_memory()
+
         #Ensures logging processes are properly closed
         self.log_queue.put(None)
         self.log_process.join(5)
@@ -199,10 +285,16 @@ class ResourceWindow(QWidget):
     This "window" is a QWidget. If it has no parent, it
     will appear as a free-floating window as we want.
     """
-    def __init__(self, logger: logging.Logger, project_geo: dict):
+    def __init__(self, logger: logging.Logger, log_queue: QueueHandler,
+                 comm_queue: multiprocessing.Queue, project_geo: dict,
+                 stored_slots: dict = None):
         super().__init__()
         self.setWindowTitle("Resource estimation")
         self.logger = logger
+        self.log_queue = log_queue
+        self.comm_queue = comm_queue
+        self.export_process = None
+        self.project_code = project_geo.get("code", "")
         self.lat = float(project_geo["latitude"])
         self.lon = float(project_geo["longitude"])
         self.alt = float(project_geo["altitude"])
@@ -215,6 +307,11 @@ class ResourceWindow(QWidget):
         dataframe_list = [number for number in range(self.number_of_databases)]
         self.widgets = {new_list: [] for new_list in widget_types}
         self.dataframes = {new_df: pd.DataFrame for new_df in  dataframe_list}
+        self.series = {new_df: None for new_df in  dataframe_list}
+        self.parser_processes = {new_df: None for new_df in  dataframe_list}
+        self.load_requests = {new_df: 0 for new_df in  dataframe_list}
+        self.stored_series = {new_df: None for new_df in  dataframe_list}
+        self.shared_series = eryaTr.SharedSeriesRegistry(self.logger)
 
         #Init layouts
         self.outer_layout = QVBoxLayout()
@@ -231,6 +328,62 @@ class ResourceWindow(QWidget):
         #Layout configuration
         self.configure_grid_layout()
         self.configure_horizontal_layout()
+        #Results of parser processes are collected periodically
+        self.comm_timer = QTimer(self)
+        self.comm_timer.timeout.connect(self.check_comm_queue)
+        self.comm_timer.start(100)
+        #Slots saved in the project file
+        if stored_slots is not None:
+            self.restore_slots(stored_slots)
+
+    def restore_slots(self, stored_slots: dict):
+        """
+        Fills the slots saved in a project. Monthly averages are read now,
+        time series only when a tool first needs them (see slot_series).
+        """
+        for i, solar_slot in stored_slots.items():
+            self.widgets["QC"][i].setCurrentText(solar_slot.data_type)
+            try:
+                monthly = solar_slot.monthly
+                if isinstance(monthly, eryaP.LazyTable):
+                    monthly = monthly.load()
+                self.dataframes[i] = monthly
+                if isinstance(solar_slot.series, pd.DataFrame):
+                    self.series[i] = self.shared_series.attach(i,
+                        eryaTr.publish_series(solar_slot.series))
+                else:
+                    self.stored_series[i] = solar_slot.series
+            except (OSError, ValueError, KeyError):
+                self.load_failed(i, "OSError")
+                continue
+            self.widgets["QL"][i].setText("Stored")
+            self.widgets["QCB1"][i].setChecked(True)
+            self.widgets["QCB2"][i].setChecked(True)
+
+    def slots_data(self):
+        """
+        Loaded slots as project SolarSlot objects, series not read yet stay lazy.
+        """
+        return {i: eryaP.SolarSlot(self.widgets["QC"][i].currentText(), self.dataframes[i],
+            self.series[i] if self.series[i] is not None else self.stored_series[i])
+            for i in range(self.number_of_databases)
+            if isinstance(self.dataframes[i], pd.DataFrame)}
+
+    def slot_series(self, i: int):
+        """
+        Time series of slot i, read from the project file into shared memory
+        the first time it is used. None if the slot has no series or the
+        project file can no longer be read (the slot is then released).
+        """
+        if (self.series[i] is None) and (self.stored_series[i] is not None):
+            try:
+                self.series[i] = self.shared_series.attach(i, self.stored_series[i].publish())
+            except (OSError, ValueError, KeyError):
+                self.logger.exception("Stored series of slot %s could not be read", i)
+                self.load_failed(i, "ProjectError")
+                return None
+            self.stored_series[i] = None
+        return self.series[i]
 
     def load_button_clicked(self):
         if self.sender() is self.widgets["QPB"][0]:
@@ -254,52 +407,190 @@ class ResourceWindow(QWidget):
         elif self.sender() is self.widgets["QPB"][9]:
             self.obtain_data_per_button(9)
 
+    @profiled
     def obtain_data_per_button(self, i: int):
+        if (self.parser_processes[i] is not None) and self.parser_processes[i].is_alive():
+            return
+        data_type = self.widgets["QC"][i].currentText()
         try:
-            if self.widgets["QC"][i].currentText() == "PVGIS - TMY":
-                self.dataframes[i] = eryaR.read_solar_data_file(
-                    "NoFile", self.widgets["QC"][i].currentText(), self.logger,
-                    self.lat, self.lon)
-                self.widgets["QL"][i].setText("Loaded")
-                self.widgets["QCB1"][i].setChecked(True)
-                self.widgets["QCB2"][i].setChecked(True)
+            if data_type == "PVGIS - TMY":
+                filepath = "NoFile"
             else:
-                self.dataframes[i] = eryaR.read_solar_data_file(
-                    file_dialog(os.getcwd(),is_folder=False),
-                    self.widgets["QC"][i].currentText(), self.logger)
+                filepath = archive_member_dialog(file_dialog(os.getcwd(),is_folder=False))
+        except OSError:
+            self.load_failed(i, "OSError")
+            return
+        if filepath == "":
+            return
+        self.release_slot(i)
+        self.load_requests[i] = next(LOAD_REQUEST_NUMBERS)
+        PENDING_HANDOVERS[self.load_requests[i]] = multiprocessing.Event()
+        self.widgets["QL"][i].setText("Loading")
+        #Parsing runs in a separate process, time series come back in shared memory
+        self.parser_processes[i] = multiprocessing.Process(
+            target=eryaR.read_solar_data_subprocess, args=(self.log_queue,
+            self.comm_queue, i, self.load_requests[i], filepath, data_type,
+            self.lat, self.lon, self.alt, PENDING_HANDOVERS[self.load_requests[i]]))
+        self.parser_processes[i].start()
+
+    def check_comm_queue(self):
+        while True:
+            try:
+                status, i, request, payload = self.comm_queue.get_nowait()
+            except queue.Empty:
+                return
+            acknowledged = PENDING_HANDOVERS.pop(request, None)
+            if request != self.load_requests.get(i):
+                #Slot was reset or reloaded meanwhile (or another window asked), result is discarded
+                if (status == "loaded") and (payload[1] is not None):
+                    eryaTr.release_handle(payload[1])
+                if acknowledged is not None:
+                    acknowledged.set()
+                continue
+            if (status == "loaded") and (payload[1] is not None):
+                self.series[i] = self.shared_series.attach(i, payload[1])
+            #The parser keeps the block open until it is attached (Windows)
+            if acknowledged is not None:
+                acknowledged.set()
+            if self.parser_processes[i] is not None:
+                self.parser_processes[i].join()
+                self.parser_processes[i] = None
+            if status == "loaded":
+                self.dataframes[i] = payload[0]
                 self.widgets["QL"][i].setText("Loaded")
                 self.widgets["QCB1"][i].setChecked(True)
                 self.widgets["QCB2"][i].setChecked(True)
-        except TypeError:
-            error_window("Error",
-                "Incorrect format file. Please check file contents")
-            self.dataframes[i]  = None
-            self.widgets["QL"][i].setText("Format error")
-            self.widgets["QCB1"][i].setChecked(False)
-            self.widgets["QCB2"][i].setChecked(False)
-        except FileNotFoundError:
-            error_window("Error",
-                "The program was unable to select or load the data file")
-            self.dataframes[i]  = None
-            self.widgets["QL"][i].setText("File error")
-            self.widgets["QCB1"][i].setChecked(False)
-            self.widgets["QCB2"][i].setChecked(False)
-        except ConnectionError:
-            error_window("Error",
-                "The program was unable to connect to external API")
-            self.dataframes[i]  = None
-            self.widgets["QL"][i].setText("Connection error")
-            self.widgets["QCB1"][i].setChecked(False)
-            self.widgets["QCB2"][i].setChecked(False)
-        except OSError:
-            error_window("Error",
-                "Incorrect format file. Please check file contents")
-            self.dataframes[i]  = None
-            self.widgets["QL"][i].setText("OS Error")
+            elif status == "error":
+                self.load_failed(i, payload)
+            else:
+                self.widgets["QL"][i].setText("Inactive")
+
+    def load_failed(self, i: int, error: str):
+        message, label = LOAD_ERRORS.get(error, LOAD_ERRORS["OSError"])
+        error_window("Error", message)
+        self.release_slot(i)
+        self.widgets["QL"][i].setText(label)
+        self.widgets["QCB1"][i].setChecked(False)
+        self.widgets["QCB2"][i].setChecked(False)
+
+    def release_slot(self, i: int):
+        #Views over the block are dropped before the block is freed
+        self.dataframes[i] = None
+        self.series[i] = None
+        self.stored_series[i] = None
+        self.shared_series.release(i)
+
+    def reset_button_clicked(self):
+        self.detach_parsers()
+        for i in range(self.number_of_databases):
+            self.load_requests[i] = next(LOAD_REQUEST_NUMBERS)
+            self.release_slot(i)
+            self.widgets["QL"][i].setText("Inactive")
             self.widgets["QCB1"][i].setChecked(False)
             self.widgets["QCB2"][i].setChecked(False)
-        except pd.errors.EmptyDataError:
-            pass
+
+    def release_shared_memory(self):
+        """
+        Frees every shared memory block, to be called before the window is destroyed.
+        """
+        self.comm_timer.stop()
+        self.reset_button_clicked()
+        #Results that arrived after the reset are discarded (and their blocks freed)
+        self.check_comm_queue()
+
+    def detach_parsers(self):
+        """
+        Forgets the parser processes still running (e.g. waiting for an
+        external API). They are not terminated, which could corrupt the shared
+        queue: they finish on their own and, as their request numbers are
+        outdated, their results are discarded and freed by check_comm_queue.
+        """
+        for i, process in self.parser_processes.items():
+            if (process is not None) and process.is_alive():
+                self.logger.info("Parser process of slot %s left to finish", i)
+            self.parser_processes[i] = None
+
+    def solar_geometry(self, i: int):
+        """
+        Solar geometry of the time grid loaded in slot i, evaluated at the
+        center of each interval. Slots sharing the same time grid share the
+        same (cached) geometry.
+        """
+        df_series = self.slot_series(i)
+        if df_series is None:
+            return None
+        return eryaS.solar_geometry(eryaT.interval_centers(df_series.index),
+            self.lat, self.lon, self.alt, eryaT.utc_offset(df_series, self.lon))
+
+    def aligned_series(self, resolution=None, fold_years: bool = False):
+        """
+        Time series of the included slots in UTC, resampled to a common step.
+        Typical years share one nominal year, historic series keep their real
+        years unless fold_years is set (their years are then averaged).
+        """
+        return eryaT.align_series({i: self.slot_series(i) for i in range(self.number_of_databases)
+            if self.widgets["QCB1"][i].isChecked() is True}, self.lon, resolution,
+            fold_years=fold_years)
+
+    def plane_of_array(self, i: int, tilt, azimuth, model: str = "perez"):
+        """
+        Irradiance of slot i transposed to a fixed (float) or tracking (array) plane.
+        """
+        geometry = self.solar_geometry(i)
+        if geometry is None:
+            return None
+        return eryaS.plane_of_array(self.slot_series(i), geometry, tilt, azimuth, model=model)
+
+    def orientation_sweep(self, i: int, orientations: list, model: str = "perez"):
+        """
+        Annual plane of array irradiation of slot i for every (tilt, azimuth).
+        """
+        geometry = self.solar_geometry(i)
+        if geometry is None:
+            return None
+        return eryaS.orientation_sweep(self.slot_series(i), geometry, orientations, model=model)
+
+    def exceedance_probabilities(self, terms: dict = None, method: str = "analytical",
+                                 years: int = 1):
+        """
+        P50/P75/P90/P99 of the included slots. Historic slots provide the
+        inter-annual variability, terms the user defined uncertainties.
+        """
+        included = [i for i in range(self.number_of_databases)
+            if (self.widgets["QCB1"][i].isChecked() is True) and
+            isinstance(self.dataframes[i], pd.DataFrame)]
+        #Series first, slots whose stored series cannot be read are released
+        historic = [self.slot_series(i) for i in included
+            if "Historic" in self.widgets["QC"][i].currentText()]
+        return eryaU.exceedance_probabilities(
+            {i: self.dataframes[i] for i in included
+             if isinstance(self.dataframes[i], pd.DataFrame)},
+            historic, terms, years=years, method=method)
+
+    def long_term_correction(self, site, reference: int, method: str = "regression",
+                             validation: bool = False):
+        """
+        Long term correction of a measured series with the historic series of
+        slot reference. site is a slot loaded as "Other" (on site measurements)
+        or an already loaded time series. Returns the corrected series, its
+        monthly averages and, if requested, the sliding window validation,
+        or None when the series cannot be used.
+        """
+        df_site = site if isinstance(site, pd.DataFrame) else self.slot_series(site)
+        df_reference = self.slot_series(reference)
+        if (df_site is None) or (df_reference is None):
+            error_window("Series not found", "Please load the measured and reference series")
+            return None
+        try:
+            overlap = eryaM.overlap_arrays(df_site, df_reference, self.lon)
+        except ValueError as err:
+            self.logger.error("Long term correction not possible: %s", err)
+            error_window("Long term correction",
+                "Measured and reference series must share a period and variables")
+            return None
+        df_series = eryaM.predict(df_reference, eryaM.fit(overlap, method))
+        df_validation = eryaM.sliding_validation(overlap, method) if validation else None
+        return df_series, eryaR.convert_series_to_ma(df_series), df_validation
 
     def configure_grid_layout(self):
         for i in range (self.number_of_databases):
@@ -319,10 +610,45 @@ class ResourceWindow(QWidget):
     def configure_horizontal_layout(self):
         self.reset_button = QPushButton("Reset")
         self.horizontal_layout.addWidget(self.reset_button)
-        self.reset_button = QPushButton("Calculate")
-        self.horizontal_layout.addWidget(self.reset_button)
-        self.reset_button = QPushButton("Refresh graphics")
-        self.horizontal_layout.addWidget(self.reset_button)
+        self.reset_button.clicked.connect(self.reset_button_clicked)
+        self.calculate_button = QPushButton("Calculate")
+        self.horizontal_layout.addWidget(self.calculate_button)
+        self.refresh_button = QPushButton("Refresh graphics")
+        self.horizontal_layout.addWidget(self.refresh_button)
+        self.export_combo = QComboBox(self)
+        self.export_combo.addItems(list(eryaE.EXPORT_FORMATS.keys()))
+        self.horizontal_layout.addWidget(self.export_combo)
+        self.export_button = QPushButton("Export")
+        self.horizontal_layout.addWidget(self.export_button)
+        self.export_button.clicked.connect(self.export_button_clicked)
+
+    def export_button_clicked(self):
+        if (self.export_process is not None) and self.export_process.is_alive():
+            error_window("Export running", "Please wait until the current export finishes")
+            return
+        monthly = {}
+        series_handles = {}
+        for i in range(self.number_of_databases):
+            if (self.widgets["QCB1"][i].isChecked() is True) and \
+                    isinstance(self.dataframes[i], pd.DataFrame):
+                self.slot_series(i)
+                if not isinstance(self.dataframes[i], pd.DataFrame):
+                    continue
+                label = str(i+1)+" - "+self.widgets["QC"][i].currentText()
+                monthly[label] = self.dataframes[i]
+                series_handles[label] = self.shared_series.handle(i)
+        if not monthly:
+            error_window("Nothing to export", "Please load and include at least one source")
+            return
+        output_dir = file_dialog(os.getcwd(), is_folder=True)
+        if output_dir == "":
+            return
+        #Files are written in a separate process so the GUI keeps responding
+        self.export_process = multiprocessing.Process(target=eryaE.export_subprocess,
+            args=(self.log_queue, output_dir, self.project_code or "resource", monthly,
+            series_handles, eryaE.EXPORT_FORMATS[self.export_combo.currentText()]))
+        self.export_process.start()
+        self.logger.info("Export started to %s", output_dir)
 
 def file_dialog(starting_directory: str, for_open: bool=True, fmt: str='', is_folder:bool=False):
     """
@@ -372,6 +698,33 @@ def file_dialog(starting_directory: str, for_open: bool=True, fmt: str='', is_fo
         return path
     return ''
 
+def archive_member_dialog(filepath: str):
+    """
+    Lets the user pick the data file inside a zip archive.
+
+    Parameters
+    ----------
+    filepath : str
+        File path selected by the user.
+
+    Returns
+    -------
+    str
+        Same path for non zip files or single member archives,
+        "archive.zip::member" otherwise. Empty string if cancelled.
+
+    """
+    if not filepath.lower().endswith(".zip"):
+        return filepath
+    members = eryaR.list_archive_members(filepath)
+    if len(members) <= 1:
+        return filepath
+    member, accepted = QInputDialog.getItem(None, "Select file",
+        "File inside the archive", members, 0, False)
+    if not accepted:
+        return ''
+    return filepath + eryaR.ARCHIVE_MEMBER_SEPARATOR + member
+
 def error_window(title: str, text: str):
     """
     Error window to communicate errors to the user.
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Long term correction module (measure, correlate, predict): a short series
+measured on site is related to a long historic reference series over their
+common period, and the relation is applied to the whole reference history.
+
+Relations are fitted month by month, either as linear regressions or as
+quantile mappings. Everything works on NumPy arrays of the overlap, which
+is built once and reused by the validation.
+"""
+import numpy as np
+import pandas as pd
+import erya_resource as eryaR
+import erya_timegrid as eryaT
+
+MCP_METHODS = ("regression", "quantile")
+IRRADIANCE_VARIABLES = ["GHI", "DHI", "DNI"]
+QUANTILE_LEVELS = 101
+MIN_MONTH_SAMPLES = 24
+VALIDATION_WINDOW = pd.Timedelta(days=30)
+
+def overlap_arrays(site: pd.DataFrame, reference: pd.DataFrame, lon: float,
+                   variables: list = None):
+    """
+    Site and reference values over their common period, on a common UTC grid.
+
+    Parameters
+    ----------
+    site : pd.DataFrame
+        Measured time series (interval start index).
+    reference : pd.DataFrame
+        Long term reference time series (interval start index).
+    lon : float
+        Site longitude, used when a source does not declare its time zone.
+    variables : list, optional
+        Variables to correct. The default is None (irradiance variables in both).
+
+    Returns
+    -------
+    dict
+        "index" (common time stamps), "month" (0-11) and, per variable,
+        "site" and "reference" arrays.
+
+    """
+    site, reference = _standard_columns(site), _standard_columns(reference)
+    variables = _variables(site, reference, variables)
+    aligned = eryaT.align_series({"site": site[variables], "reference": reference[variables]},
+        lon)
+    index = aligned["site"].index.intersection(aligned["reference"].index)
+    if len(index) == 0:
+        raise ValueError("Site and reference series do not overlap")
+    positions = {label: df.index.get_indexer(index) for label, df in aligned.items()}
+    return {"index": index, "month": index.month.to_numpy() - 1, "variables": variables,
+        "site": {var: aligned["site"][var].to_numpy(dtype=float)[positions["site"]]
+            for var in variables},
+        "reference": {var: aligned["reference"][var].to_numpy(dtype=float)[positions["reference"]]
+            for var in variables}}
+
+def fit(overlap: dict, method: str = "regression", mask: np.ndarray = None):
+    """
+    Monthly relations between reference and site for every variable.
+
+    Parameters
+    ----------
+    overlap : dict
+        Output of overlap_arrays.
+    method : str, optional
+        "regression" (linear, per month) or "quantile" (quantile mapping,
+        per month). The default is "regression".
+    mask : np.ndarray, optional
+        Overlap samples used in the fit. The default is None (all).
+
+    Returns
+    -------
+    dict
+        "method" and "parameters" (variable as key, monthly parameters as value).
+
+    """
+    if method not in MCP_METHODS:
+        raise ValueError("Unknown MCP method "+str(method))
+    parameters = {}
+    for var in overlap["variables"]:
+        x, y, month = overlap["reference"][var], overlap["site"][var], overlap["month"]
+        valid = _valid(var, x, y)
+        if mask is not None:
+            valid = valid & mask
+        if method == "regression":
+            parameters[var] = _regression_parameters(_regression_stats(month, x, y, valid))
+        else:
+            parameters[var] = _quantile_parameters(month, x, y, valid)
+    return {"method": method, "parameters": parameters}
+
+def predict(reference: pd.DataFrame, relations: dict):
+    """
+    Applies the fitted relations to a reference series (any resolution).
+
+    Returns
+    -------
+    pd.DataFrame
+        Corrected series, same index and attributes as the reference.
+
+    """
+    reference = _standard_columns(reference)
+    month = reference.index.month.to_numpy() - 1
+    corrected = {var: _apply(var, reference[var].to_numpy(dtype=float), month,
+        relations["method"], parameters)
+        for var, parameters in relations["parameters"].items()}
+    df_corrected = pd.DataFrame(corrected, index=reference.index)
+    df_corrected.attrs.update(reference.attrs)
+    return df_corrected
+
+def long_term_correction(site: pd.DataFrame, reference: pd.DataFrame, lon: float,
+                         method: str = "regression", variables: list = None):
+    """
+    Long term corrected series and monthly averages of a site.
+
+    Parameters
+    ----------
+    site : pd.DataFrame
+        Measured time series, usually one or two years.
+    reference : pd.DataFrame
+        Historic reference time series (e.g. Solargis historic).
+    lon : float
+        Site longitude.
+    method : str, optional
+        "regression" or "quantile". The default is "regression".
+    variables : list, optional
+        Variables to correct. The default is None (irradiance variables in both).
+
+    Returns
+    -------
+    tuple
+        Corrected series over the whole reference period and its monthly
+        averages, in the same format as the database conversions.
+
+    """
+    relations = fit(overlap_arrays(site, reference, lon, variables), method)
+    df_corrected = predict(reference, relations)
+    return df_corrected, eryaR.convert_series_to_ma(df_corrected)
+
+def sliding_validation(overlap: dict, method: str = "regression",
+                       window: pd.Timedelta = VALIDATION_WINDOW, step: pd.Timedelta = None):
+    """
+    Out of sample errors: every window of the overlap is predicted with the
+    relations fitted on the rest of it.
+
+    Parameters
+    ----------
+    overlap : dict
+        Output of overlap_arrays.
+    method : str, optional
+        "regression" or "quantile". The default is "regression".
+    window : pd.Timedelta, optional
+        Length of the validation window. The default is VALIDATION_WINDOW.
+    step : pd.Timedelta, optional
+        Shift between windows. The default is None (window length).
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per window start, "<VAR> bias" and "<VAR> rmse" columns
+        relative to the measured mean of the window.
+
+    """
+    if method not in MCP_METHODS:
+        raise ValueError("Unknown MCP method "+str(method))
+    window, step = pd.Timedelta(window), pd.Timedelta(step or window)
+    #Windows are made of whole steps, so regression sums are only computed per step
+    blocks = np.asarray((overlap["index"] - overlap["index"][0])//step, dtype=np.int64)
+    number_blocks = int(blocks[-1]) + 1
+    window_blocks = max(1, int(round(window/step)))
+    starts = np.arange(max(1, number_blocks - window_blocks + 1))
+    month = overlap["month"]
+
+    results = {}
+    for var in overlap["variables"]:
+        x, y = overlap["reference"][var], overlap["site"][var]
+        valid = _valid(var, x, y)
+        if method == "regression":
+            block_stats = _regression_stats(blocks*12 + month, x, y, valid,
+                12*number_blocks).reshape(5, number_blocks, 12)
+            cumulative = np.concatenate([np.zeros((5, 1, 12)), block_stats.cumsum(axis=1)],
+                axis=1)
+            total = cumulative[:, -1]
+        bias, rmse = np.full(len(starts), np.nan), np.full(len(starts), np.nan)
+        for k, start in enumerate(starts):
+            end = min(start + window_blocks, number_blocks)
+            inside = (blocks >= start) & (blocks < end)
+            tested = inside & valid
+            if not tested.any():
+                continue
+            if method == "regression":
+                parameters = _regression_parameters(total - (cumulative[:, end]
+                    - cumulative[:, start]))
+            else:
+                parameters = _quantile_parameters(month, x, y, valid & ~inside)
+            error = _apply(var, x[tested], month[tested], method, parameters) - y[tested]
+            measured = y[tested].mean()
+            bias[k] = error.mean()/measured
+            rmse[k] = np.sqrt(np.mean(error**2))/measured
+        results[var+" bias"] = bias
+        results[var+" rmse"] = rmse
+    index = overlap["index"][0] + pd.to_timedelta(starts*step.value)
+    return pd.DataFrame(results, index=pd.DatetimeIndex(index, name="Window start"))
+
+def _standard_columns(df_series):
+    return df_series.rename(columns={"DIF":"DHI"})
+
+def _variables(site, reference, variables):
+    if variables is None:
+        variables = [var for var in IRRADIANCE_VARIABLES
+            if (var in site.columns) and (var in reference.columns)]
+    missing = [var for var in variables
+        if (var not in site.columns) or (var not in reference.columns)]
+    if missing or not variables:
+        raise ValueError("Variables not available in both series: "+", ".join(missing))
+    return list(variables)
+
+def _valid(var, x, y):
+    valid = np.isfinite(x) & np.isfinite(y)
+    if var in IRRADIANCE_VARIABLES:
+        #Night time zeros would dominate the fit
+        valid &= (x > 0)
+    return valid
+
+def _regression_stats(keys, x, y, valid, length=12):
+    #Sufficient statistics of the least squares fit of every key (n, sx, sy, sxx, sxy)
+    weights = valid.astype(float)
+    x, y = np.where(valid, x, 0), np.where(valid, y, 0)
+    return np.stack([np.bincount(keys, weights=values, minlength=length)
+        for values in (weights, x, y, x*x, x*y)])
+
+def _regression_parameters(stats):
+    #Slope and intercept per month, months without enough samples use the overall fit
+    def solve(n, sx, sy, sxx, sxy):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            variance = n*sxx - sx**2
+            slope = np.where(variance > 0, (n*sxy - sx*sy)/variance,
+                np.where(sx > 0, sy/sx, 1.0))
+            intercept = np.where(n > 0, (sy - slope*sx)/n, 0.0)
+        return slope, intercept
+    slope, intercept = solve(*stats)
+    overall_slope, overall_intercept = solve(*stats.sum(axis=-1, keepdims=True))
+    sparse = stats[0] < MIN_MONTH_SAMPLES
+    return (np.where(sparse, overall_slope, slope),
+        np.where(sparse, overall_intercept, intercept))
+
+def _quantile_parameters(month, x, y, valid):
+    #Reference and site quantiles of every month (12, levels)
+    levels = np.linspace(0, 100, QUANTILE_LEVELS)
+    overall = (np.percentile(x[valid], levels), np.percentile(y[valid], levels)) \
+        if valid.any() else (levels, levels)
+    quantiles_x, quantiles_y = np.empty((12, QUANTILE_LEVELS)), np.empty((12, QUANTILE_LEVELS))
+    for m in range(12):
+        selected = valid & (month == m)
+        if selected.sum() < MIN_MONTH_SAMPLES:
+            quantiles_x[m], quantiles_y[m] = overall
+        else:
+            quantiles_x[m] = np.percentile(x[selected], levels)
+            quantiles_y[m] = np.percentile(y[selected], levels)
+    return quantiles_x, quantiles_y
+
+def _apply(var, x, month, method, parameters):
+    if method == "regression":
+        slope, intercept = parameters
+        corrected = slope[month]*x + intercept[month]
+    else:
+        quantiles_x, quantiles_y = parameters
+        corrected = np.empty_like(x)
+        #Months are mapped separately, values outside the fitted range are scaled
+        order = np.argsort(month, kind="stable")
+        bounds = np.searchsorted(month[order], np.arange(13))
+        for m in range(12):
+            positions = order[bounds[m]:bounds[m+1]]
+            values = x[positions]
+            mapped = np.interp(values, quantiles_x[m], quantiles_y[m])
+            top = quantiles_x[m][-1]
+            if top > 0:
+                above = values > top
+                mapped[above] = values[above]*quantiles_y[m][-1]/top
+            corrected[positions] = mapped
+    if var in IRRADIANCE_VARIABLES:
+        corrected = np.where(x > 0, np.maximum(corrected, 0), x)
+    return corrected
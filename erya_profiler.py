@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in profiling of GUI actions and batch runs.
+
+Enabled with the ERYA_PROFILE environment variable (any value but "0") or
+with the --profile command line flag. Each wrapped call writes a report with
+cProfile statistics, tracemalloc peak and top retained allocations into the
+log folder.
+"""
+import os
+import io
+import time
+import pstats
+import logging
+import cProfile
+import functools
+import threading
+import tracemalloc
+
+PROFILE_ENV_VARIABLE = "ERYA_PROFILE"
+PROFILE_TOP_FUNCTIONS = 40
+PROFILE_TOP_ALLOCATIONS = 15
+
+_state = threading.local()
+#Allocations of the profiling tools themselves and of imports are left out of reports
+_MEMORY_FILTERS = [tracemalloc.Filter(False, filename) for filename in (
+    tracemalloc.__file__, cProfile.__file__, pstats.__file__, __file__,
+    "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>")]
+
+def profiling_enabled():
+    return os.environ.get(PROFILE_ENV_VARIABLE, "0") not in ("", "0")
+
+def enable_profiling():
+    #Environment variable so subprocesses inherit the setting
+    os.environ[PROFILE_ENV_VARIABLE] = "1"
+
+def profiled(function):
+    """
+    Decorator profiling the wrapped function when profiling is enabled.
+    Every call writes its own report, nested profiled calls included: the
+    outer profiler is paused meanwhile, so their functions only appear in
+    their own report, while elapsed time and memory peak stay complete.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not profiling_enabled():
+            return function(*args, **kwargs)
+        stack = _state.__dict__.setdefault("stack", [])
+        if not stack:
+            #Tracing started elsewhere is left running
+            _state.tracing = not tracemalloc.is_tracing()
+            if _state.tracing:
+                tracemalloc.start()
+        if stack:
+            #Outer call is paused, its peak so far is kept aside
+            outer = stack[-1]
+            outer["profiler"].disable()
+            outer["peak"] = max(outer["peak"], tracemalloc.get_traced_memory()[1])
+        frame = {"profiler": cProfile.Profile(), "peak": 0,
+            "snapshot": tracemalloc.take_snapshot().filter_traces(_MEMORY_FILTERS)}
+        stack.append(frame)
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            frame["profiler"].enable()
+            return function(*args, **kwargs)
+        finally:
+            frame["profiler"].disable()
+            elapsed = time.perf_counter() - start
+            peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            retained = tracemalloc.take_snapshot().filter_traces(_MEMORY_FILTERS).compare_to(
+                frame["snapshot"], "lineno")
+            stack.pop()
+            if stack:
+                #Outer peak includes this call, its profiler resumes
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+                tracemalloc.reset_peak()
+                stack[-1]["profiler"].enable()
+            elif _state.tracing:
+                tracemalloc.stop()
+            _write_report(function.__qualname__, _find_logger(args, kwargs),
+                frame["profiler"], elapsed, peak, retained)
+    return wrapper
+
+def _find_logger(args, kwargs):
+    #Logger passed as argument or owned by the instance, main logger otherwise
+    if isinstance(kwargs.get("logger"), logging.Logger):
+        return kwargs["logger"]
+    for arg in args:
+        if isinstance(arg, logging.Logger):
+            return arg
+    if args and isinstance(getattr(args[0], "logger", None), logging.Logger):
+        return args[0].logger
+    return logging.getLogger("ERYA_main")
+
+def _write_report(name: str, logger: logging.Logger, profiler: cProfile.Profile,
+        elapsed: float, peak: int, retained: list):
+    report = io.StringIO()
+    report.write("Function: "+name+"\n")
+    report.write("PID: "+str(os.getpid())+"\n")
+    report.write("Elapsed time: %.3f s\n" % elapsed)
+    report.write("Memory peak: %.1f MiB\n\n" % (peak/2**20))
+    #Memory still allocated when the call returns, not what made the peak
+    report.write("Top retained allocations (end of the call minus its start)\n")
+    for stat in retained[:PROFILE_TOP_ALLOCATIONS]:
+        report.write(str(stat)+"\n")
+    report.write("\n")
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_FUNCTIONS)
+
+    filepath = os.getcwd()+os.sep+"log"+os.sep+"profile_"+name.replace(".", "_")+ \
+        "_"+str(time.time())+".txt"
+    try:
+        with open(filepath, "w", encoding="utf-8") as report_file:
+            report_file.write(report.getvalue())
+        logger.info("Profile of %s (%.3f s, peak %.1f MiB) written to %s",
+            name, elapsed, peak/2**20, filepath)
+    except OSError:
+        logger.error("Unable to write profile report %s", filepath)
@@ -2,8 +2,19 @@
 """
 Interface between main/GUI and different modules
 """
+import os
+import json
 import logging
+import zipfile
+import numpy as np
 import pandas as pd
+import erya_transport as eryaTr
+
+PROJECT_FORMAT = "ERYA project"
+PROJECT_VERSION = 1
+PROJECT_EXTENSION = "erya"
+MANIFEST = "manifest.json"
+COPY_BLOCK_SIZE = 1 << 20
 
 class Resource_comparator:
     def __init__(self):
@@ -22,88 +33,311 @@ class Resource_comparator:
             logger.error("%s key not found in dataframe dictionary", df_name)
             
 
-# class PVProject:
-#     def __init__(self):
-#         self.name = None
-#         self.project_bd_code = None
-#         self.project_ea_code = None
-#         self.solardata = SolarDatabase()
-#         self.string = StringSizeCalculator()
-#         self.site = ProjectSite()
-#         self.plant = PVPlant()
-#         self.pyield = YieldCalculator()
-
-# class SolarDatabase():
-#     def __init__(self):
-#         self.solargis = None
-#         self.meteonorm = None
-#         self.pvgis = None
-#         self.nasa_power = None
-#         self.nrel = None
-#         self.siar = None
-#         self.start_year = None
-#         self.end_year = None
-
-# class StringSizeCalculator():
-#     def __init__(self):
-#         self.tolerance = None
-
-# class ProjectSite():
-#     def __init__(self):
-#         self.coord = {
-#             "latitude" : None,
-#             "longitude" : None,
-#             "altitude" : None
-#             }
-#         self.location = {
-#             "country" : None,
-#             "region" : None,
-#             "municipality" : None
-#             }
-#         self.longitude = None
-#         self.altitude = None
-        
-# class PVPlant():
-#     def __init__(self):
-#         self.module = {
-#             "model" : None,
-#             "manufacturer" : None,
-#             "voc" : None,
-#             "vmpp" : None,
-#             "impp" : None,
-#             "isc" : None, 
-#             "alpha" : None, 
-#             "beta" : None, 
-#             "gamma" : None, 
-#             "length" : None,
-#             "width" : None,
-#             "cell_type" : None,
-#             "cell_size" : None,
-#             "module_type" : None,
-#             "bifacial" : None,
-#             "noct" : None,
-#             "cell_number" : None,
-#             "efficiency" : None,
-#             "first_year_degradation" : None,
-#             "yearly_degradation" : None,
-#             "nominal_voltage" : None
-#         }
-
-#         self.inverter = {
-#              "nominal_voltage" : None,
-#              "MPPT_min" : None,
-#              "MPPT_max" : None,
-#              "MPPT_min_Q" : None,
-#              "wake_up_threshold" : None
-#             }
-
-#         self.structure = {}
-    
+class PVProject:
+    def __init__(self):
+        self.name = None
+        self.project_bd_code = None
+        self.project_ea_code = None
+        self.solardata = SolarDatabase()
+        self.string = StringSizeCalculator()
+        self.site = ProjectSite()
+        self.plant = PVPlant()
+        self.pyield = YieldCalculator()
 
+class SolarDatabase():
+    def __init__(self):
+        #Resource window slot number as key, SolarSlot as value
+        self.slots = {}
+        self.start_year = None
+        self.end_year = None
 
+class SolarSlot():
+    def __init__(self, data_type: str, monthly=None, series=None):
+        self.data_type = data_type
+        #DataFrame, or LazyTable/LazySeries until first used
+        self.monthly = monthly
+        self.series = series
 
+class StringSizeCalculator():
+    def __init__(self):
+        self.tolerance = None
 
-    
+class ProjectSite():
+    def __init__(self):
+        self.coord = {
+            "latitude" : None,
+            "longitude" : None,
+            "altitude" : None
+            }
+        self.location = {
+            "country" : None,
+            "region" : None,
+            "municipality" : None
+            }
 
-    
-    
\ No newline at end of file
+class PVPlant():
+    def __init__(self):
+        self.module = {
+            "model" : None,
+            "manufacturer" : None,
+            "voc" : None,
+            "vmpp" : None,
+            "impp" : None,
+            "isc" : None,
+            "alpha" : None,
+            "beta" : None,
+            "gamma" : None,
+            "length" : None,
+            "width" : None,
+            "cell_type" : None,
+            "cell_size" : None,
+            "module_type" : None,
+            "bifacial" : None,
+            "noct" : None,
+            "cell_number" : None,
+            "efficiency" : None,
+            "first_year_degradation" : None,
+            "yearly_degradation" : None,
+            "nominal_voltage" : None
+        }
+
+        self.inverter = {
+             "nominal_voltage" : None,
+             "MPPT_min" : None,
+             "MPPT_max" : None,
+             "MPPT_min_Q" : None,
+             "wake_up_threshold" : None
+            }
+
+        self.structure = {}
+
+class YieldCalculator():
+    def __init__(self):
+        #Result name as key, DataFrame (or LazyTable) as value
+        self.results = {}
+
+class LazyTable:
+    """
+    Small table stored in a project file, read the first time it is needed.
+    """
+    def __init__(self, filepath: str, member: str):
+        self.filepath = filepath
+        self.member = member
+        self.data = None
+
+    def load(self):
+        if self.data is None:
+            try:
+                with zipfile.ZipFile(self.filepath) as archive:
+                    table = json.loads(archive.read(self.member))
+            except (zipfile.BadZipFile, ValueError, KeyError) as err:
+                #Project file replaced or damaged since it was opened
+                raise OSError("Unable to read "+self.member) from err
+            self.data = pd.DataFrame(table["data"], index=table["index"],
+                columns=table["columns"])
+        return self.data
+
+class LazySeries:
+    """
+    Time series stored in a project file, read the first time it is needed.
+    """
+    def __init__(self, filepath: str, entry: dict):
+        self.filepath = filepath
+        self.entry = entry
+
+    def load(self):
+        """
+        Reads the series into process memory.
+        """
+        index = np.empty(self.entry["rows"], dtype=np.int64)
+        values = np.empty((len(self.entry["columns"]), self.entry["rows"]), dtype=np.float64)
+        self._read_into(index, values)
+        df_series = pd.DataFrame(values.T, columns=self.entry["columns"], copy=False,
+            index=pd.DatetimeIndex(index.view("datetime64[ns]"),
+            name=self.entry["index_name"]))
+        df_series.attrs.update(self.entry["attrs"])
+        return df_series
+
+    def publish(self):
+        """
+        Reads the series straight into a shared memory block.
+
+        Returns
+        -------
+        dict
+            Block handle (see erya_transport).
+
+        """
+        return eryaTr.publish_arrays(self.entry["rows"], self.entry["columns"],
+            self._read_into, self.entry["index_name"], self.entry["attrs"])
+
+    def _read_into(self, index, values):
+        try:
+            with zipfile.ZipFile(self.filepath) as archive:
+                _read_npy_into(archive, self.entry["index"], index)
+                _read_npy_into(archive, self.entry["values"], values)
+        except (zipfile.BadZipFile, ValueError, KeyError, EOFError) as err:
+            #Project file replaced or damaged since it was opened
+            raise OSError("Unable to read stored series from "+self.filepath) from err
+
+def save_project(project: PVProject, filepath: str, logger: logging.Logger):
+    """
+    Saves a project in a single zip container: a JSON manifest plus one
+    member per dataset (JSON for tables, uncompressed .npy for time series).
+    Datasets not loaded yet are copied from their original file as they are.
+
+    Parameters
+    ----------
+    project : PVProject
+        Project to be saved.
+    filepath : str
+        Project file path.
+    logger : logging.Logger
+        Logger.
+
+    Returns
+    -------
+    None.
+
+    """
+    manifest = {"format": PROJECT_FORMAT, "version": PROJECT_VERSION,
+        "name": project.name, "project_bd_code": project.project_bd_code,
+        "project_ea_code": project.project_ea_code,
+        "site": {"coord": project.site.coord, "location": project.site.location},
+        "plant": {"module": project.plant.module, "inverter": project.plant.inverter,
+            "structure": project.plant.structure},
+        "string": {"tolerance": project.string.tolerance},
+        "solardata": {"start_year": project.solardata.start_year,
+            "end_year": project.solardata.end_year, "slots": {}},
+        "yield": {}}
+    #Written next to the target and moved at the end, the old file stays valid meanwhile
+    temporary = filepath+".tmp"
+    try:
+        with zipfile.ZipFile(temporary, "w", allowZip64=True) as archive:
+            for slot, solar_slot in project.solardata.slots.items():
+                prefix = "solardata/"+str(slot)+"/"
+                entry = {"data_type": solar_slot.data_type, "monthly": None, "series": None}
+                if solar_slot.monthly is not None:
+                    entry["monthly"] = prefix+"monthly.json"
+                    _write_table(archive, entry["monthly"], solar_slot.monthly)
+                if solar_slot.series is not None:
+                    entry["series"] = _write_series(archive, prefix, solar_slot.series)
+                manifest["solardata"]["slots"][str(slot)] = entry
+            for name, table in project.pyield.results.items():
+                manifest["yield"][name] = "yield/"+name+".json"
+                _write_table(archive, manifest["yield"][name], table)
+            archive.writestr(MANIFEST, json.dumps(manifest, indent=1))
+        os.replace(temporary, filepath)
+    except (OSError, ValueError, TypeError, KeyError) as err:
+        logger.error("Unable to save project %s", filepath)
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise OSError from err
+    logger.info("Project saved in %s", filepath)
+
+def load_project(filepath: str, logger: logging.Logger):
+    """
+    Opens a project reading only its manifest. Datasets are returned as
+    LazyTable/LazySeries objects and read when first used.
+
+    Parameters
+    ----------
+    filepath : str
+        Project file path.
+    logger : logging.Logger
+        Logger.
+
+    Returns
+    -------
+    PVProject
+        Project.
+
+    """
+    try:
+        with zipfile.ZipFile(filepath) as archive:
+            manifest = json.loads(archive.read(MANIFEST))
+        if manifest.get("format") != PROJECT_FORMAT:
+            raise ValueError("Not an ERYA project file")
+        project = PVProject()
+        project.name = manifest["name"]
+        project.project_bd_code = manifest["project_bd_code"]
+        project.project_ea_code = manifest["project_ea_code"]
+        project.site.coord.update(manifest["site"]["coord"])
+        project.site.location.update(manifest["site"]["location"])
+        project.plant.module.update(manifest["plant"]["module"])
+        project.plant.inverter.update(manifest["plant"]["inverter"])
+        project.plant.structure = manifest["plant"]["structure"]
+        project.string.tolerance = manifest["string"]["tolerance"]
+        project.solardata.start_year = manifest["solardata"]["start_year"]
+        project.solardata.end_year = manifest["solardata"]["end_year"]
+        for slot, entry in manifest["solardata"]["slots"].items():
+            project.solardata.slots[int(slot)] = SolarSlot(entry["data_type"],
+                None if entry["monthly"] is None else LazyTable(filepath, entry["monthly"]),
+                None if entry["series"] is None else LazySeries(filepath, entry["series"]))
+        for name, member in manifest["yield"].items():
+            project.pyield.results[name] = LazyTable(filepath, member)
+    except FileNotFoundError as err:
+        logger.error("Project file %s not found", filepath)
+        raise FileNotFoundError from err
+    except (OSError, zipfile.BadZipFile, ValueError, KeyError) as err:
+        logger.error("Incorrect project file %s", filepath)
+        raise TypeError from err
+    logger.info("Project %s opened from %s", project.name, filepath)
+    return project
+
+def _write_table(archive, member, table):
+    if isinstance(table, LazyTable):
+        table = table.load()
+    table = table.apply(pd.to_numeric, errors="coerce")
+    archive.writestr(member, json.dumps({"index": [str(item) for item in table.index],
+        "columns": [str(column) for column in table.columns],
+        "data": table.to_numpy(dtype=float).tolist()}), zipfile.ZIP_DEFLATED)
+
+def _write_series(archive, prefix, series):
+    if isinstance(series, LazySeries):
+        #Copied as stored, the series is never loaded
+        entry = dict(series.entry, index=prefix+"index.npy", values=prefix+"values.npy")
+        with zipfile.ZipFile(series.filepath) as source:
+            _copy_member(source, series.entry["index"], archive, entry["index"])
+            _copy_member(source, series.entry["values"], archive, entry["values"])
+        return entry
+    entry = {"index": prefix+"index.npy", "values": prefix+"values.npy",
+        "rows": len(series), "columns": [str(column) for column in series.columns],
+        "index_name": series.index.name, "attrs": dict(series.attrs)}
+    index = pd.DatetimeIndex(series.index).values.astype("datetime64[ns]").view(np.int64)
+    with archive.open(entry["index"], "w", force_zip64=True) as member:
+        np.lib.format.write_array(member, index)
+    #Values written column by column, (columns x rows) float64 array
+    with archive.open(entry["values"], "w", force_zip64=True) as member:
+        np.lib.format.write_array_header_2_0(member, {"descr": np.lib.format.dtype_to_descr(
+            np.dtype("<f8")), "fortran_order": False,
+            "shape": (len(entry["columns"]), entry["rows"])})
+        for column in series.columns:
+            member.write(np.ascontiguousarray(series[column].to_numpy(), dtype="<f8").data)
+    return entry
+
+def _copy_member(source, source_member, archive, member):
+    with source.open(source_member) as source_file, \
+            archive.open(member, "w", force_zip64=True) as target_file:
+        while True:
+            block = source_file.read(COPY_BLOCK_SIZE)
+            if not block:
+                break
+            target_file.write(block)
+
+def _read_npy_into(archive, member, array):
+    with archive.open(member) as npy_file:
+        version = np.lib.format.read_magic(npy_file)
+        if version == (1, 0):
+            shape, _, _ = np.lib.format.read_array_header_1_0(npy_file)
+        else:
+            shape, _, _ = np.lib.format.read_array_header_2_0(npy_file)
+        if tuple(shape) != array.shape:
+            raise ValueError("Inconsistent dataset "+member)
+        buffer = memoryview(array).cast("B")
+        position = 0
+        while position < len(buffer):
+            read = npy_file.readinto(buffer[position:])
+            if read == 0:
+                raise ValueError("Truncated dataset "+member)
+            position += read
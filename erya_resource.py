@@ -2,30 +2,63 @@
 """
 Resource module
 """
-import logging
+import os
 import re
+import bz2
+import gzip
+import lzma
+import queue
+import codecs
+import logging
+import zipfile
+import threading
+from contextlib import contextmanager
+from logging.handlers import QueueHandler
 import requests
+import numpy as np
 import pandas as pd
+from erya_profiler import profiled
+import erya_timegrid as eryaT
+import erya_transport as eryaTr
+
+COMPRESSED_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+ARCHIVE_MEMBER_SEPARATOR = "::"
+#Column names accepted in measured series files (lower case) and their standard name
+MEASURED_COLUMNS = {"ghi": "GHI", "dhi": "DHI", "dif": "DHI", "dni": "DNI", "temp": "TEMP",
+    "tamb": "TEMP", "t2m": "TEMP", "ws": "WS"}
+MEASURED_TIME_COLUMNS = ("timestamp", "datetime", "date", "time")
+READ_BLOCK_SIZE = 1 << 20
 
+@profiled
 def read_solar_data_file(filepath: str, data_type: str, logger: logging.Logger,
-            lat: str = None, lon: str = None, alt: str = None):
+            lat: str = None, lon: str = None, alt: str = None, keep_series: bool = False):
     if (filepath is None) or (filepath == ""):
         raise pd.errors.EmptyDataError
     try:
+        df_series = None
         if data_type == "Solargis - Monthly Averages":
             df_ma = _extract_solargis_ma(filepath)
         elif data_type == "Solargis - TMY":
-            df_ma = _extract_solargis_tmy(filepath)
-            df_ma = _convert_solargis_tmy_to_ma(df_ma)
+            df_series = _extract_solargis_tmy(filepath)
+            df_ma = _convert_solargis_tmy_to_ma(df_series)
         elif data_type == "Solargis - Historic":
-            df_ma = _extract_solargis_hist(filepath)
-            df_ma = _convert_solargis_hist_to_ma(df_ma)
+            df_series = _extract_solargis_hist(filepath)
+            df_ma = _convert_solargis_hist_to_ma(df_series)
         elif data_type == "Meteonorm - TMY":
-            df_ma = _extract_meteonorm_tmy(filepath)
-            df_ma = _convert_meteonorm_tmy_to_ma(df_ma)
+            df_series = _extract_meteonorm_tmy(filepath)
+            df_ma = _convert_meteonorm_tmy_to_ma(df_series)
         elif data_type == "PVGIS - TMY":
-            df_ma = _extract_pvgis_tmy(lat, lon)
-            df_ma = _convert_pvgis_tmy_to_ma(df_ma)
+            df_series = _extract_pvgis_tmy(lat, lon)
+            df_ma = _convert_pvgis_tmy_to_ma(df_series)
+        elif data_type == "Other":
+            #On site measurements
+            df_series = _extract_measured_series(filepath)
+            df_ma = convert_series_to_ma(df_series)
+        else:
+            raise TypeError("No reader available for "+str(data_type))
+        #Time series are only kept when requested (export, further analysis)
+        if keep_series:
+            return df_ma, _normalize_series(df_series)
         return df_ma
     except FileNotFoundError as err:
         logger.error("File not found or not avaiable")
@@ -40,13 +73,195 @@ def read_solar_data_file(filepath: str, data_type: str, logger: logging.Logger,
         logger.error("Incorrect format file")
         raise TypeError from err
 
+def read_solar_data_subprocess(log_queue: QueueHandler, comm_queue: QueueHandler,
+        slot: int, request: int, filepath: str, data_type: str,
+        lat: float = None, lon: float = None, alt: float = None, acknowledged=None):
+    """
+    Parser subprocess. Monthly averages are sent through the queue, the time
+    series through a shared memory block whose handle travels with them.
+
+    Parameters
+    ----------
+    log_queue : logging.QueueHandler()
+        Shared logging queue.
+    comm_queue : multiprocessing.Queue
+        Queue where the result is sent as (status, slot, request, payload).
+    slot : int
+        Resource slot the data belongs to.
+    request : int
+        Load request number, lets the GUI discard outdated results.
+    filepath, data_type, lat, lon, alt :
+        See read_solar_data_file.
+    acknowledged : multiprocessing.Event, optional
+        Set by the GUI once the time series is attached. Needed on Windows,
+        where the block is kept open by this process until then.
+
+    Returns
+    -------
+    None.
+
+    """
+    logger = logging.getLogger("ERYA_parser")
+    if logger.hasHandlers():
+        logger.handlers.clear()
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    try:
+        df_ma, df_series = read_solar_data_file(filepath, data_type, logger,
+            lat, lon, alt, keep_series=True)
+        handle = None if df_series is None else eryaTr.publish_series(df_series)
+        comm_queue.put(("loaded", slot, request, (df_ma, handle)))
+        if (handle is not None) and (acknowledged is not None):
+            eryaTr.wait_handover(handle, acknowledged)
+    except pd.errors.EmptyDataError:
+        comm_queue.put(("empty", slot, request, None))
+    except (TypeError, OSError) as err:
+        comm_queue.put(("error", slot, request, type(err).__name__))
+    except Exception:
+        #The GUI must always get an answer, whatever happened
+        logger.exception("Unexpected error when reading %s", filepath)
+        comm_queue.put(("error", slot, request, "OSError"))
+
+def convert_series_to_ma(df_series: pd.DataFrame):
+    """
+    Monthly averages of any time series, in the same format as the database
+    conversions: irradiation (kWh/m2) averaged over the available years,
+    temperature and wind speed averaged.
+
+    Parameters
+    ----------
+    df_series : pd.DataFrame
+        Time series (W/m2, interval start index).
+
+    Returns
+    -------
+    pd.DataFrame
+        Monthly averages indexed by month name.
+
+    """
+    df_series = df_series.rename(columns={"DIF":"DHI"})
+    irradiance = [column for column in ["GHI","DHI","DNI"] if column in df_series.columns]
+    others = [column for column in ["TEMP","WS"] if column in df_series.columns]
+    grouped = df_series.groupby([df_series.index.year, df_series.index.month])
+    df_months = pd.concat([grouped[irradiance].sum()*_step_hours(df_series.index)/1000,
+        grouped[others].mean()], axis=1)
+    #Mean over the years of each month, as number of months per year may differ
+    df_ma = df_months.groupby(level=1).mean().rename_axis("Month")
+    return _convert_index_months_from_number_to_name(df_ma[irradiance+others])
+
+def list_archive_members(filepath: str):
+    """
+    Lists the files stored inside a zip archive.
+
+    Parameters
+    ----------
+    filepath : str
+        Zip archive path.
+
+    Returns
+    -------
+    list
+        Member names, directories excluded.
+
+    """
+    try:
+        with zipfile.ZipFile(filepath) as archive:
+            return [info.filename for info in archive.infolist() if not info.is_dir()]
+    except zipfile.BadZipFile as err:
+        raise OSError from err
+
+def _open_data_file(filepath):
+    #Zip members are selected with "archive.zip::member.csv"
+    archive_path, _, member = filepath.partition(ARCHIVE_MEMBER_SEPARATOR)
+    extension = os.path.splitext(archive_path)[1].lower()
+    if extension in COMPRESSED_OPENERS:
+        return _ThreadedLineReader(
+            lambda: COMPRESSED_OPENERS[extension](archive_path, "rb"))
+    if extension == ".zip":
+        return _ThreadedLineReader(lambda: _open_zip_member(archive_path, member))
+    return open(filepath, encoding="utf-8")
+
+@contextmanager
+def _open_zip_member(archive_path, member):
+    with zipfile.ZipFile(archive_path) as archive:
+        if member == "":
+            members = [info.filename for info in archive.infolist() if not info.is_dir()]
+            if len(members) != 1:
+                raise FileNotFoundError("Archive member must be selected")
+            member = members[0]
+        with archive.open(member) as stream:
+            yield stream
+
+class _ThreadedLineReader:
+    """
+    Line iterator over a compressed file. Decompression runs in a background
+    thread (zlib, bz2 and lzma release the GIL) so it overlaps with parsing,
+    and only a few blocks are kept in memory at any time.
+    """
+    def __init__(self, opener, encoding: str = "utf-8"):
+        self._opener = opener
+        self._blocks = queue.Queue(maxsize=8)
+        self._stop = threading.Event()
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._thread = threading.Thread(target=self._read_blocks, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join(1)
+
+    def __iter__(self):
+        pending = ""
+        while True:
+            block = self._blocks.get()
+            if block is None:
+                break
+            if isinstance(block, Exception):
+                raise block
+            lines = (pending + self._decoder.decode(block)).split("\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line.rstrip("\r") + "\n"
+        pending += self._decoder.decode(b"", final=True)
+        if pending != "":
+            yield pending.rstrip("\r")
+
+    def _read_blocks(self):
+        try:
+            with self._opener() as stream:
+                while not self._stop.is_set():
+                    block = stream.read(READ_BLOCK_SIZE)
+                    if not block:
+                        break
+                    self._put(block)
+        except KeyError as err:
+            self._put(FileNotFoundError(str(err)))
+        except (zipfile.BadZipFile, lzma.LZMAError, EOFError) as err:
+            self._put(OSError(str(err)))
+        except OSError as err:
+            self._put(err)
+        finally:
+            self._put(None)
+
+    def _put(self, item):
+        #Gives up when the reader has been closed before the end of file
+        while not self._stop.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
 def _extract_solargis_ma(filepath):
     columns = []
     data = []
     flag_data = 0
 
-    with open(filepath, encoding="utf-8") as solargis_file:
-        for i,row in enumerate(solargis_file.readlines()):
+    with _open_data_file(filepath) as solargis_file:
+        for i,row in enumerate(solargis_file):
             if (row[0]=="#") or (i==0):
                 continue
             if row.find("Month") != -1:
@@ -73,12 +288,12 @@ def _extract_solargis_ma(filepath):
 def _extract_solargis_tmy(filepath):
     columns = []
     data = []
+    header = []
     flag_data = 0
-    year=pd.to_datetime(pd.date_range(
-        start="01/01/1900 00:30", periods=8760, freq="H"),format="%d/%m/%Y %H:%M")
-    with open(filepath, encoding="utf-8") as solargis_file:
-        for i,row in enumerate(solargis_file.readlines()):
+    with _open_data_file(filepath) as solargis_file:
+        for i,row in enumerate(solargis_file):
             if (row[0]=="#") or (i==0):
+                header.append(row)
                 continue
             if(row.find("Day") != -1) and (row.find("#") == -1):
                 flag_data = 1
@@ -86,20 +301,36 @@ def _extract_solargis_tmy(filepath):
             elif (row.find("#") == -1) and (flag_data == 1):
                 data.append(row.split(";"))
     df_solargis_tmy = pd.DataFrame(data=data,columns=columns)
-    df_solargis_tmy["Date"] = year
+    time = _split_integers(df_solargis_tmy["Time"], ":")
+    if df_solargis_tmy["Day"].str.contains(".", regex=False).any():
+        #Day given as DD.MM, 29 February only fits in a leap year
+        day = _split_integers(df_solargis_tmy["Day"], ".")
+        leap_day = ((day[:, 1] == 2) & (day[:, 0] == 29)).any()
+        index = eryaT.build_datetime_index(eryaT.TMY_LEAP_YEAR if leap_day
+            else eryaT.TMY_YEAR, day[:, 1], day[:, 0], time[:, 0], time[:, 1])
+    else:
+        #Day given as day of the year, 366 days only fit in a leap year
+        day = df_solargis_tmy["Day"].astype(int).to_numpy()
+        index = eryaT.build_day_of_year_index(eryaT.TMY_YEAR if day.max() < 366
+            else eryaT.TMY_LEAP_YEAR, day, time[:, 0], time[:, 1])
+    df_solargis_tmy["Date"] = eryaT.to_interval_start(index, eryaT.detect_resolution(index))
     df_solargis_tmy.drop(columns=["Day","Time"], inplace=True)
     df_solargis_tmy["Month"] = df_solargis_tmy.Date.dt.month
     df_solargis_tmy.set_index("Date", inplace=True)
     df_solargis_tmy = df_solargis_tmy.apply(pd.to_numeric,errors="coerce")
+    df_solargis_tmy.attrs["utc_offset"] = eryaT.detect_utc_offset(header)
+    df_solargis_tmy.attrs[eryaT.TYPICAL_YEAR] = True
     return df_solargis_tmy
 
 def _extract_solargis_hist(filepath):
     columns = []
     data = []
+    header = []
     flag_data = 0
-    with open(filepath, encoding="utf-8") as solargis_file:
-        for i,row in enumerate(solargis_file.readlines()):
+    with _open_data_file(filepath) as solargis_file:
+        for i,row in enumerate(solargis_file):
             if (row[0]=="#") or (i==0):
+                header.append(row)
                 continue
             if(row.find("Date") != -1) and (row.find("#") == -1):
                 flag_data = 1
@@ -107,14 +338,17 @@ def _extract_solargis_hist(filepath):
             elif (row.find("#") == -1) and (flag_data == 1):
                 data.append(row.split(";"))
     df_solargis_hist = pd.DataFrame(data=data,columns=columns)
-    df_solargis_hist["Date"] = df_solargis_hist[
-        "Date"].astype(str) + " " + df_solargis_hist["Time"].astype(str)
-    df_solargis_hist["Date"].replace("\.", "/", regex=True, inplace=True)
-    df_solargis_hist["Date"] = pd.to_datetime(df_solargis_hist["Date"],format="%d/%m/%Y %H:%M")
+    date = _split_integers(df_solargis_hist["Date"], ".")
+    time = _split_integers(df_solargis_hist["Time"], ":")
+    index = eryaT.build_datetime_index(date[:, 2], date[:, 1], date[:, 0],
+        time[:, 0], time[:, 1])
+    df_solargis_hist["Date"] = eryaT.to_interval_start(index, eryaT.detect_resolution(index))
     df_solargis_hist.drop(columns=["Time"], inplace=True)
+    df_solargis_hist.attrs["utc_offset"] = eryaT.detect_utc_offset(header)
     return df_solargis_hist
 
 def _convert_solargis_tmy_to_ma(df_solargis_tmy):
+    step_hours = _step_hours(df_solargis_tmy.index)
     df_solargis_tmy = df_solargis_tmy[["Month","GHI","DIF","DNI","TEMP","WS"]
         ].groupby("Month").agg({"GHI":"sum","DIF":["sum"],"DNI":["sum"],
         "TEMP":["mean"],"WS":["mean"]})
@@ -123,10 +357,11 @@ def _convert_solargis_tmy_to_ma(df_solargis_tmy):
         "DIFsum":"DHI","DNIsum":"DNI","TEMPmean":"TEMP",
         "WSmean":"WS","WDmean":"WD"})
     df_solargis_tmy = _convert_index_months_from_number_to_name(df_solargis_tmy)
-    df_solargis_tmy[["GHI","DHI","DNI"]] = df_solargis_tmy[["GHI","DHI","DNI"]]/1000
+    df_solargis_tmy[["GHI","DHI","DNI"]] = step_hours*df_solargis_tmy[["GHI","DHI","DNI"]]/1000
     return df_solargis_tmy
 
 def _convert_solargis_hist_to_ma(df_solargis_hist):
+    step_hours = _step_hours(pd.DatetimeIndex(df_solargis_hist.Date))
     number_months = _unique_months_data(df_solargis_hist)
     df_solargis_hist = df_solargis_hist.apply(pd.to_numeric,errors="coerce")
     df_solargis_hist.set_index("Date", inplace=True)
@@ -140,7 +375,7 @@ def _convert_solargis_hist_to_ma(df_solargis_hist):
     df_solargis_hist = df_solargis_hist.assign(NM=number_months)
     df_solargis_hist = df_solargis_hist.apply(pd.to_numeric,errors="coerce")
     df_solargis_hist = _convert_index_months_from_number_to_name(df_solargis_hist)
-    df_solargis_hist[["GHI","DHI","DNI"]] = (1/1000)*df_solargis_hist[
+    df_solargis_hist[["GHI","DHI","DNI"]] = (step_hours/1000)*df_solargis_hist[
         ["GHI","DHI","DNI"]].div(df_solargis_hist.NM, axis=0)
     df_solargis_hist = df_solargis_hist.drop(columns="NM")
     return df_solargis_hist
@@ -148,10 +383,12 @@ def _convert_solargis_hist_to_ma(df_solargis_hist):
 def _extract_meteonorm_tmy(filepath):
     columns = []
     data = []
+    header = []
     flag_data = 0
-    with open(filepath, encoding="utf-8") as meteonorm_file:
-        for i,row in enumerate(meteonorm_file.readlines()):
+    with _open_data_file(filepath) as meteonorm_file:
+        for i,row in enumerate(meteonorm_file):
             if (row[0]=="#") or (i==0):
+                header.append(row)
                 continue
             if row.find("Date (MM/DD/YYYY)") != -1:
                 flag_data = 1
@@ -159,11 +396,13 @@ def _extract_meteonorm_tmy(filepath):
             elif flag_data == 1:
                 data.append(row.split(","))
     df_meteonorm_tmy = pd.DataFrame(data=data,columns=columns)
-    df_meteonorm_tmy["Time (HH:MM)"] = df_meteonorm_tmy["Time (HH:MM)"].str.replace("24:00","00:00")
-    df_meteonorm_tmy["Date (MM/DD/YYYY)"] = df_meteonorm_tmy[
-        "Date (MM/DD/YYYY)"].astype(str) + " " + df_meteonorm_tmy["Time (HH:MM)"].astype(str)
-    df_meteonorm_tmy["Date (MM/DD/YYYY)"] = pd.to_datetime(
-        df_meteonorm_tmy["Date (MM/DD/YYYY)"],format="%m/%d/%Y %H:%M")
+    date = _split_integers(df_meteonorm_tmy["Date (MM/DD/YYYY)"], "/")
+    time = _split_integers(df_meteonorm_tmy["Time (HH:MM)"], ":")
+    index = eryaT.build_datetime_index(date[:, 2], date[:, 0], date[:, 1],
+        time[:, 0], time[:, 1])
+    #Time stamps run 01:00..24:00 when given at the end of the interval
+    df_meteonorm_tmy["Date (MM/DD/YYYY)"] = eryaT.to_interval_start(index,
+        eryaT.detect_resolution(index), "end" if (time[:, 0] == 24).any() else "start")
     df_meteonorm_tmy.drop(columns=["Time (HH:MM)"], inplace=True)
     df_meteonorm_tmy = df_meteonorm_tmy.rename(columns={
         "Date (MM/DD/YYYY)":"Date",
@@ -174,9 +413,12 @@ def _extract_meteonorm_tmy(filepath):
         "Wspd (m/s)":"WS"})
     df_meteonorm_tmy.set_index("Date", inplace=True)
     df_meteonorm_tmy = df_meteonorm_tmy.apply(pd.to_numeric,errors="coerce")
+    df_meteonorm_tmy.attrs["utc_offset"] = eryaT.detect_utc_offset(header)
+    df_meteonorm_tmy.attrs[eryaT.TYPICAL_YEAR] = True
     return df_meteonorm_tmy
 
 def _convert_meteonorm_tmy_to_ma(df_meteonorm_tmy):
+    step_hours = _step_hours(df_meteonorm_tmy.index)
     df_meteonorm_tmy["Month"] = df_meteonorm_tmy.index.month
     df_meteonorm_tmy = df_meteonorm_tmy[["Month","GHI","DHI","DNI","TEMP","WS"]
         ].groupby("Month").agg({"GHI":"sum","DHI":["sum"],"DNI":["sum"],
@@ -185,6 +427,8 @@ def _convert_meteonorm_tmy_to_ma(df_meteonorm_tmy):
     df_meteonorm_tmy = df_meteonorm_tmy.rename(columns={"GHIsum":"GHI",
         "DHIsum":"DHI","DNIsum":"DNI","TEMPmean":"TEMP",
         "WSmean":"WS","WDmean":"WD"})
+    df_meteonorm_tmy[["GHI","DHI","DNI"]] = (step_hours/1000)*df_meteonorm_tmy[
+        ["GHI","DHI","DNI"]]
     df_meteonorm_tmy = _convert_index_months_from_number_to_name(df_meteonorm_tmy)
     return df_meteonorm_tmy
 
@@ -196,9 +440,15 @@ def _extract_pvgis_tmy(lat,lon):
         if response.status_code == 200:
             df_pvgis_tmy = response.json()["outputs"]["tmy_hourly"]
             df_pvgis_tmy = pd.json_normalize(df_pvgis_tmy)
-            df_pvgis_tmy["time(UTC)"] = df_pvgis_tmy["time(UTC)"].str.split(":").str[0] \
-                + " " + df_pvgis_tmy["time(UTC)"].str.split(":").str[1]
-            df_pvgis_tmy["time(UTC)"] = pd.to_datetime(df_pvgis_tmy["time(UTC)"],format="%Y%m%d %H%M")
+            #Time stamps given as YYYYMMDD:HHMM, every month may come from a
+            #different year so they are moved to a single TMY year to stay sorted
+            time_utc = df_pvgis_tmy["time(UTC)"].str
+            month = time_utc[4:6].astype(int).to_numpy()
+            day = time_utc[6:8].astype(int).to_numpy()
+            leap_day = ((month == 2) & (day == 29)).any()
+            df_pvgis_tmy["time(UTC)"] = eryaT.build_datetime_index(
+                eryaT.TMY_LEAP_YEAR if leap_day else eryaT.TMY_YEAR, month, day,
+                time_utc[9:11].astype(int).to_numpy(), time_utc[11:13].astype(int).to_numpy())
             df_pvgis_tmy.drop(columns=["IR(h)","RH","WD10m", "SP"], inplace=True)
             df_pvgis_tmy = df_pvgis_tmy.rename(columns={
                 "time(UTC)":"Date",
@@ -209,6 +459,8 @@ def _extract_pvgis_tmy(lat,lon):
                 "WS10m":"WS"})
             df_pvgis_tmy.set_index("Date", inplace=True)
             df_pvgis_tmy = df_pvgis_tmy.apply(pd.to_numeric,errors="coerce")
+            df_pvgis_tmy.attrs["utc_offset"] = 0.0
+            df_pvgis_tmy.attrs[eryaT.TYPICAL_YEAR] = True
             return df_pvgis_tmy
         else:
             raise ConnectionError
@@ -216,6 +468,7 @@ def _extract_pvgis_tmy(lat,lon):
         raise ConnectionError from err
 
 def _convert_pvgis_tmy_to_ma(df_pvgis_tmy_to_ma):
+    step_hours = _step_hours(df_pvgis_tmy_to_ma.index)
     df_pvgis_tmy_to_ma["Month"] = df_pvgis_tmy_to_ma.index.month
     df_pvgis_tmy_to_ma = df_pvgis_tmy_to_ma[["Month","GHI","DHI","DNI","TEMP","WS"]
         ].groupby("Month").agg({"GHI":"sum","DHI":["sum"],"DNI":["sum"],
@@ -224,11 +477,113 @@ def _convert_pvgis_tmy_to_ma(df_pvgis_tmy_to_ma):
     df_pvgis_tmy_to_ma = df_pvgis_tmy_to_ma.rename(columns={"GHIsum":"GHI",
         "DHIsum":"DHI","DNIsum":"DNI","TEMPmean":"TEMP",
         "WSmean":"WS","WDmean":"WD"})
-    df_pvgis_tmy_to_ma[["GHI","DHI","DNI"]] = (1/1000)*df_pvgis_tmy_to_ma[
+    df_pvgis_tmy_to_ma[["GHI","DHI","DNI"]] = (step_hours/1000)*df_pvgis_tmy_to_ma[
         ["GHI","DHI","DNI"]]
     df_pvgis_tmy_to_ma = _convert_index_months_from_number_to_name(df_pvgis_tmy_to_ma)
     return df_pvgis_tmy_to_ma
 
+def _extract_measured_series(filepath):
+    """
+    Generic measured series: "#" header lines (time zone, "time stamp: end"
+    when loggers label the end of the interval, "date format: DD/MM/YYYY"),
+    a row of column names and ";", tab or "," separated rows. Time stamps in
+    one column or in separate date and time columns, dates as YYYY-MM-DD or
+    with the year last, day and month order declared or detected.
+    """
+    columns = []
+    data = []
+    header = []
+    separator = None
+    with _open_data_file(filepath) as measured_file:
+        for row in measured_file:
+            row = row.rstrip("\r\n")
+            if (row == "") or (row[0] == "#"):
+                header.append(row)
+            elif separator is None:
+                separator = next((item for item in (";", "\t", ",") if item in row), ",")
+                columns = [item.strip() for item in row.split(separator)]
+            else:
+                data.append(row.split(separator))
+    df_measured = pd.DataFrame(data=data, columns=columns)
+    names = {column.lower(): column for column in df_measured.columns}
+    time_columns = [names[name] for name in MEASURED_TIME_COLUMNS if name in names]
+    if ("date" in names) and ("time" in names):
+        dates, times = df_measured[names["date"]].str.strip(), df_measured[names["time"]]
+    elif time_columns:
+        parts = df_measured[time_columns[0]].str.strip().str.split(r"[ T]", n=1,
+            regex=True, expand=True)
+        dates, times = parts[0], parts[1] if 1 in parts.columns else None
+    else:
+        raise KeyError("Time stamp column not found")
+    date = _split_integers(dates.str.replace("/", "-", regex=False).str.replace(".", "-",
+        regex=False), "-")
+    if times is None:
+        time = np.zeros((len(date), 2), dtype=int)
+    else:
+        time = _split_integers(times, ":")
+    year, month, day = _date_fields(date, _declared_date_order(header))
+    index = eryaT.build_datetime_index(year, month, day, time[:, 0], time[:, 1],
+        time[:, 2] if time.shape[1] > 2 else 0)
+    label_end = any(("end" in line.lower()) and ("stamp" in line.lower() or
+        "label" in line.lower()) for line in header)
+    df_measured = df_measured.rename(columns={column: MEASURED_COLUMNS[column.lower()]
+        for column in df_measured.columns if column.lower() in MEASURED_COLUMNS})
+    df_measured = df_measured[[column for column in ["GHI","DHI","DNI","TEMP","WS"]
+        if column in df_measured.columns]]
+    if "GHI" not in df_measured.columns:
+        raise KeyError("GHI column not found")
+    df_measured = df_measured.apply(pd.to_numeric, errors="coerce")
+    df_measured.index = eryaT.to_interval_start(index, eryaT.detect_resolution(index),
+        "end" if label_end else "start")
+    df_measured.index.name = "Date"
+    df_measured = df_measured.sort_index()
+    df_measured.attrs["utc_offset"] = eryaT.detect_utc_offset(header)
+    return df_measured
+
+def _declared_date_order(header):
+    #e.g. "# Date format: MM/DD/YYYY" gives "mdy"
+    for line in header:
+        if ("date format" not in line.lower()) and ("date order" not in line.lower()):
+            continue
+        value = line.split(":", 1)[-1].upper()
+        positions = {key: value.find(key) for key in ("Y", "M", "D")}
+        if min(positions.values()) >= 0:
+            return "".join(sorted(positions, key=positions.get)).lower()
+    return None
+
+def _date_fields(date, order=None):
+    #Year, month and day columns of split dates, day and month order detected when not declared
+    if order is None:
+        if (date[:, 0] > 31).all():
+            order = "ymd"
+        elif (date[:, 0] > 12).any():
+            order = "dmy"
+        elif (date[:, 1] > 12).any():
+            order = "mdy"
+        else:
+            raise ValueError("Ambiguous day and month order, please declare the date format")
+    return tuple(date[:, order.index(key)] for key in "ymd")
+
+def _normalize_series(df_series):
+    if df_series is None:
+        return None
+    attrs = dict(df_series.attrs)
+    if "Date" in df_series.columns:
+        df_series = df_series.set_index("Date")
+    df_series.columns = [str(column).strip() for column in df_series.columns]
+    df_series = df_series.drop(columns=["Day", "Time", "Month", "Year", "MY"],
+        errors="ignore")
+    df_series = df_series.apply(pd.to_numeric,errors="coerce")
+    df_series.attrs.update(attrs)
+    return df_series
+
+def _step_hours(index: pd.DatetimeIndex):
+    #Irradiance sums are energy only when weighted by the time step
+    return eryaT.detect_resolution(index)/pd.Timedelta(hours=1)
+
+def _split_integers(column: pd.Series, separator: str):
+    return column.str.strip().str.split(separator, expand=True).astype(int).to_numpy()
+
 def _unique_months_data(df_data: pd.DataFrame):
     df_data["Month"] = df_data.Date.dt.month
     df_data["Year"] = df_data.Date.dt.year
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Solar geometry and plane of array transposition module
+"""
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+SOLAR_CONSTANT = 1367.0
+GEOMETRY_CACHE_SIZE = 16
+#Perez et al. (1990) all sites composite coefficients, one row per sky clearness bin
+PEREZ_EPSILON_BINS = np.array([1.065, 1.23, 1.5, 1.95, 2.8, 4.5, 6.2])
+PEREZ_COEFFICIENTS = np.array([
+    [-0.0083117, 0.5877285, -0.0620636, -0.0596012, 0.0721249, -0.0220216],
+    [0.1299457, 0.6825954, -0.1513752, -0.0189325, 0.0659650, -0.0288748],
+    [0.3296958, 0.4868735, -0.2210958, 0.0554140, -0.0639588, -0.0260542],
+    [0.5682053, 0.1874525, -0.2951290, 0.1088631, -0.1519229, -0.0139754],
+    [0.8730280, -0.3920403, -0.3616149, 0.2255647, -0.4620442, 0.0012448],
+    [1.1326077, -1.2367284, -0.4118494, 0.2877813, -0.8230357, 0.0558651],
+    [1.0601591, -1.5999137, -0.3589221, 0.2642124, -1.1272340, 0.1310694],
+    [0.6777470, -0.3272588, -0.2504286, 0.1561313, -1.3765031, 0.2506212]])
+
+_GEOMETRY_CACHE = OrderedDict()
+
+class SolarGeometry:
+    """
+    Solar position arrays for a site and a time grid. Angles in radians,
+    azimuths measured clockwise from north. Arrays are read-only because
+    instances are shared through the cache.
+    """
+    def __init__(self, times: pd.DatetimeIndex, lat: float, lon: float,
+                 alt: float, utc_offset: float):
+        self.times = times
+        self.lat = lat
+        self.lon = lon
+        self.alt = alt
+        self.utc_offset = utc_offset
+
+        #Spencer (1971) series for declination, equation of time and distance
+        hours = times.hour.values + times.minute.values/60 + times.second.values/3600
+        day_angle = 2*np.pi*(times.dayofyear.values - 1 + (hours - 12)/24)/365
+        declination = (0.006918 - 0.399912*np.cos(day_angle) + 0.070257*np.sin(day_angle)
+            - 0.006758*np.cos(2*day_angle) + 0.000907*np.sin(2*day_angle)
+            - 0.002697*np.cos(3*day_angle) + 0.00148*np.sin(3*day_angle))
+        equation_of_time = 229.18*(0.000075 + 0.001868*np.cos(day_angle)
+            - 0.032077*np.sin(day_angle) - 0.014615*np.cos(2*day_angle)
+            - 0.040849*np.sin(2*day_angle))
+        self.i0 = SOLAR_CONSTANT*(1.00011 + 0.034221*np.cos(day_angle)
+            + 0.00128*np.sin(day_angle) + 0.000719*np.cos(2*day_angle)
+            + 0.000077*np.sin(2*day_angle))
+
+        solar_time = hours + (4*lon - 60*utc_offset + equation_of_time)/60
+        hour_angle = np.radians(15*(solar_time - 12))
+        lat_rad = np.radians(lat)
+        self.cos_zenith = np.clip(np.sin(lat_rad)*np.sin(declination)
+            + np.cos(lat_rad)*np.cos(declination)*np.cos(hour_angle), -1, 1)
+        self.zenith = np.arccos(self.cos_zenith)
+        self.sin_zenith = np.sin(self.zenith)
+        self.azimuth = np.arctan2(np.sin(hour_angle), np.cos(hour_angle)*np.sin(lat_rad)
+            - np.tan(declination)*np.cos(lat_rad)) + np.pi
+
+        #Kasten and Young (1989) relative air mass, undefined below the horizon
+        zenith_deg = np.minimum(np.degrees(self.zenith), 90)
+        self.airmass = 1/(self.cos_zenith.clip(0) + 0.50572*(96.07995 - zenith_deg)**-1.6364)
+        self.airmass[self.zenith > np.radians(90)] = np.nan
+
+        for array in (self.i0, self.cos_zenith, self.zenith, self.sin_zenith,
+                      self.azimuth, self.airmass):
+            array.flags.writeable = False
+
+def solar_geometry(times: pd.DatetimeIndex, lat: float, lon: float, alt: float,
+                   utc_offset: float = 0.0):
+    """
+    Returns the solar geometry for a site and time grid, computed only once.
+
+    Parameters
+    ----------
+    times : pd.DatetimeIndex
+        Instants where the sun position is evaluated.
+    lat : float
+        Latitude (degrees).
+    lon : float
+        Longitude (degrees, east positive).
+    alt : float
+        Altitude (masl).
+    utc_offset : float, optional
+        Hours between the time grid and UTC. The default is 0.0 (UTC).
+
+    Returns
+    -------
+    SolarGeometry
+        Cached geometry shared by every slot and orientation using the same grid.
+
+    """
+    times = pd.DatetimeIndex(times)
+    key = (float(lat), float(lon), float(alt), float(utc_offset), len(times),
+        hashlib.blake2b(times.asi8.tobytes(), digest_size=16).hexdigest())
+    if key in _GEOMETRY_CACHE:
+        _GEOMETRY_CACHE.move_to_end(key)
+        return _GEOMETRY_CACHE[key]
+    geometry = SolarGeometry(times, float(lat), float(lon), float(alt), float(utc_offset))
+    _GEOMETRY_CACHE[key] = geometry
+    if len(_GEOMETRY_CACHE) > GEOMETRY_CACHE_SIZE:
+        _GEOMETRY_CACHE.popitem(last=False)
+    return geometry
+
+def clear_geometry_cache():
+    _GEOMETRY_CACHE.clear()
+
+def tracker_orientation(geometry: SolarGeometry, axis_azimuth: float = 180.0,
+                        max_angle: float = 60.0, gcr: float = None):
+    """
+    Orientation of a horizontal single axis tracker.
+
+    Parameters
+    ----------
+    geometry : SolarGeometry
+        Solar geometry.
+    axis_azimuth : float, optional
+        Azimuth of the rotation axis (degrees). The default is 180.0 (N-S axis).
+    max_angle : float, optional
+        Rotation limit (degrees). The default is 60.0.
+    gcr : float, optional
+        Ground coverage ratio, enables backtracking when given. The default is None.
+
+    Returns
+    -------
+    tuple
+        Surface tilt and surface azimuth arrays (degrees).
+
+    """
+    relative_azimuth = geometry.azimuth - np.radians(axis_azimuth)
+    rotation = np.arctan2(geometry.sin_zenith*np.sin(relative_azimuth),
+        geometry.cos_zenith.clip(1e-6))
+    if gcr is not None:
+        #Rotation is reduced to avoid row to row shading
+        cos_rotation = np.abs(np.cos(rotation))/gcr
+        correction = np.arccos(np.minimum(cos_rotation, 1))
+        rotation = rotation - np.sign(rotation)*correction
+    rotation = np.clip(rotation, -np.radians(max_angle), np.radians(max_angle))
+    rotation[geometry.cos_zenith <= 0] = 0
+    surface_tilt = np.degrees(np.abs(rotation))
+    surface_azimuth = np.where(rotation >= 0, axis_azimuth + 90, axis_azimuth - 90) % 360
+    return surface_tilt, surface_azimuth
+
+def plane_of_array(df_series: pd.DataFrame, geometry: SolarGeometry, tilt, azimuth,
+                   albedo: float = 0.2, model: str = "perez"):
+    """
+    Transposes horizontal irradiance to a tilted or tracking plane.
+
+    Parameters
+    ----------
+    df_series : pd.DataFrame
+        Time series with GHI, DHI and DNI columns (W/m2) on the geometry time grid.
+    geometry : SolarGeometry
+        Solar geometry of the series.
+    tilt : float or np.ndarray
+        Surface tilt (degrees), array for tracking surfaces.
+    azimuth : float or np.ndarray
+        Surface azimuth (degrees from north), array for tracking surfaces.
+    albedo : float, optional
+        Ground reflectance. The default is 0.2.
+    model : str, optional
+        Sky diffuse model, "perez" or "haydavies". The default is "perez".
+
+    Returns
+    -------
+    pd.DataFrame
+        POA (total), POA_B (beam), POA_D (sky diffuse) and POA_R (ground reflected).
+
+    """
+    ghi, dhi, dni = _irradiance_arrays(df_series)
+    sky = _sky_terms(dhi, dni, geometry, model)
+    beam, diffuse, reflected = _transpose(ghi, dhi, dni, geometry, sky,
+        np.radians(tilt), np.radians(azimuth), albedo)
+    return pd.DataFrame({"POA": beam + diffuse + reflected, "POA_B": beam,
+        "POA_D": diffuse, "POA_R": reflected}, index=df_series.index)
+
+def orientation_sweep(df_series: pd.DataFrame, geometry: SolarGeometry,
+                      orientations: list, albedo: float = 0.2, model: str = "perez"):
+    """
+    Annual irradiation on every (tilt, azimuth) candidate. Geometry and sky
+    model terms are computed once and reused for all orientations.
+
+    Returns
+    -------
+    pd.DataFrame
+        POA annual irradiation (kWh/m2) indexed by tilt and azimuth.
+
+    """
+    ghi, dhi, dni = _irradiance_arrays(df_series)
+    sky = _sky_terms(dhi, dni, geometry, model)
+    results = []
+    for tilt, azimuth in orientations:
+        beam, diffuse, reflected = _transpose(ghi, dhi, dni, geometry, sky,
+            np.radians(tilt), np.radians(azimuth), albedo)
+        #Mean irradiance to yearly irradiation, independent of the time step
+        results.append(np.nanmean(beam + diffuse + reflected)*8.76)
+    return pd.DataFrame({"POA": results}, index=pd.MultiIndex.from_tuples(
+        orientations, names=["Tilt", "Azimuth"]))
+
+def _irradiance_arrays(df_series):
+    dhi_column = "DHI" if "DHI" in df_series.columns else "DIF"
+    return (df_series["GHI"].to_numpy(dtype=float), df_series[dhi_column].to_numpy(dtype=float),
+        df_series["DNI"].to_numpy(dtype=float))
+
+def _sky_terms(dhi, dni, geometry, model):
+    #Orientation independent terms of the diffuse models
+    if model == "haydavies":
+        return {"ai": np.clip(np.nan_to_num(dni/geometry.i0), 0, 1)}
+    if model == "perez":
+        zenith = geometry.zenith
+        with np.errstate(divide="ignore", invalid="ignore"):
+            epsilon = ((dhi + dni)/dhi + 1.041*zenith**3)/(1 + 1.041*zenith**3)
+        delta = np.nan_to_num(dhi*geometry.airmass/geometry.i0)
+        coefficients = PEREZ_COEFFICIENTS[np.digitize(np.nan_to_num(epsilon, nan=1.0),
+            PEREZ_EPSILON_BINS)]
+        f1 = np.maximum(0, coefficients[:, 0] + coefficients[:, 1]*delta
+            + coefficients[:, 2]*zenith)
+        f2 = coefficients[:, 3] + coefficients[:, 4]*delta + coefficients[:, 5]*zenith
+        return {"f1": f1, "f2": f2}
+    raise ValueError("Unknown transposition model "+str(model))
+
+def _transpose(ghi, dhi, dni, geometry, sky, tilt, azimuth, albedo):
+    cos_tilt = np.cos(tilt)
+    cos_aoi = np.clip(geometry.cos_zenith*cos_tilt + geometry.sin_zenith*np.sin(tilt)
+        *np.cos(geometry.azimuth - azimuth), 0, None)
+    daytime = geometry.cos_zenith > 0
+    beam = np.where(daytime, dni*cos_aoi, 0)
+    if "ai" in sky:
+        ratio = cos_aoi/np.maximum(geometry.cos_zenith, 0.01745)
+        diffuse = dhi*(sky["ai"]*ratio + (1 - sky["ai"])*(1 + cos_tilt)/2)
+    else:
+        ratio = cos_aoi/np.maximum(geometry.cos_zenith, np.cos(np.radians(85)))
+        diffuse = dhi*np.maximum(0, (1 - sky["f1"])*(1 + cos_tilt)/2 + sky["f1"]*ratio
+            + sky["f2"]*np.sin(tilt))
+    reflected = ghi*albedo*(1 - cos_tilt)/2
+    return beam, diffuse, reflected
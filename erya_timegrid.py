@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Time grid module: resolution and time zone detection, datetime index
+construction and alignment of the different sources on a common grid.
+
+Every series is indexed at the start of its averaging interval. Typical
+years (attribute TYPICAL_YEAR) are compared on a single nominal year.
+"""
+import re
+import math
+import numpy as np
+import pandas as pd
+
+TMY_YEAR = 1900
+TMY_LEAP_YEAR = 2000
+#Series attribute marking typical (meteorological) years, whatever year their file uses
+TYPICAL_YEAR = "typical_year"
+DEFAULT_RESOLUTION = pd.Timedelta(hours=1)
+_UTC_OFFSET_PATTERN = re.compile(r"(?:UTC|GMT)\s*(?:([+-])\s*(\d{1,2})(?::?(\d{2}))?)?")
+
+def days_from_civil(year, month, day):
+    """
+    Days since 1970-01-01 of a (proleptic gregorian) date, vectorized.
+
+    Parameters
+    ----------
+    year, month, day : np.ndarray
+        Integer date components.
+
+    Returns
+    -------
+    np.ndarray
+        Number of days (int64).
+
+    """
+    year = np.asarray(year, dtype=np.int64)
+    month = np.asarray(month, dtype=np.int64)
+    day = np.asarray(day, dtype=np.int64)
+    #Years start in March so the leap day is the last day of the year
+    year = year - (month <= 2)
+    era = np.floor_divide(year, 400)
+    year_of_era = year - era*400
+    day_of_year = (153*((month + 9) % 12) + 2)//5 + day - 1
+    day_of_era = year_of_era*365 + year_of_era//4 - year_of_era//100 + day_of_year
+    return era*146097 + day_of_era - 719468
+
+def build_datetime_index(year, month, day, hour=0, minute=0, second=0):
+    """
+    Builds a datetime index from integer components without string parsing.
+    Hours equal to 24 are moved to 00:00 of the next day.
+
+    Returns
+    -------
+    pd.DatetimeIndex
+        Datetime index.
+
+    """
+    seconds = (days_from_civil(year, month, day)*86400 + np.asarray(hour, dtype=np.int64)*3600
+        + np.asarray(minute, dtype=np.int64)*60 + np.asarray(second, dtype=np.int64))
+    return pd.DatetimeIndex((seconds*10**9).astype("datetime64[ns]"))
+
+def build_day_of_year_index(year: int, day_of_year, hour=0, minute=0):
+    """
+    Builds a datetime index from the day of the year and the time of the day.
+
+    Returns
+    -------
+    pd.DatetimeIndex
+        Datetime index.
+
+    """
+    day_of_year = np.asarray(day_of_year, dtype=np.int64)
+    return build_datetime_index(np.full(day_of_year.shape, year), 1, day_of_year,
+        hour, minute)
+
+def detect_resolution(index: pd.DatetimeIndex):
+    """
+    Time step of a series (median of the differences between time stamps).
+    """
+    if len(index) < 2:
+        return DEFAULT_RESOLUTION
+    return pd.Timedelta(int(np.median(np.diff(_nanoseconds(index)))))
+
+def to_interval_start(index: pd.DatetimeIndex, resolution: pd.Timedelta,
+                      label: str = "start"):
+    """
+    Moves time stamps to the start of their averaging interval.
+
+    Parameters
+    ----------
+    index : pd.DatetimeIndex
+        Original time stamps.
+    resolution : pd.Timedelta
+        Time step.
+    label : str, optional
+        "end" for time stamps at the end of the interval, "start" or "center"
+        otherwise (labels are floored to the grid). The default is "start".
+
+    Returns
+    -------
+    pd.DatetimeIndex
+        Interval start time stamps.
+
+    """
+    values = _nanoseconds(index)
+    step = resolution.value
+    if label == "end":
+        values = values - step
+    else:
+        values = values - values % step
+    return pd.DatetimeIndex(values.astype("datetime64[ns]"))
+
+def interval_centers(index: pd.DatetimeIndex):
+    """
+    Center of each averaging interval, used to evaluate the sun position.
+    """
+    return index + detect_resolution(index)/2
+
+def detect_utc_offset(header: list):
+    """
+    UTC offset (hours) declared in the header of a data file, None if not found.
+    """
+    for line in header:
+        lowered = line.lower()
+        if ("time zone" not in lowered) and ("timezone" not in lowered) and \
+                ("time reference" not in lowered):
+            continue
+        match = _UTC_OFFSET_PATTERN.search(line.upper())
+        if match is None:
+            continue
+        if match.group(1) is None:
+            return 0.0
+        offset = int(match.group(2)) + int(match.group(3) or 0)/60
+        return -offset if match.group(1) == "-" else offset
+    return None
+
+def utc_offset(df_series: pd.DataFrame, lon: float):
+    """
+    UTC offset of a series, from the file header when declared or estimated
+    from the longitude otherwise.
+    """
+    offset = df_series.attrs.get("utc_offset")
+    if offset is None:
+        return float(round(lon/15))
+    return float(offset)
+
+def common_resolution(series: dict):
+    """
+    Coarsest resolution among the series, so no source is given detail it has not.
+    """
+    return max(detect_resolution(df.index) for df in series.values())
+
+def align_series(series: dict, lon: float, resolution: pd.Timedelta = None,
+                 to_utc: bool = True, fold_years: bool = False):
+    """
+    Resamples every series on a common grid with interval averaging.
+    Typical years are folded onto TMY_YEAR (see fold_to_typical_year) so
+    that sources declaring different nominal years share their time stamps.
+
+    Parameters
+    ----------
+    series : dict
+        Source label as key and time series (interval start index) as value.
+    lon : float
+        Site longitude, used when a source does not declare its time zone.
+    resolution : pd.Timedelta, optional
+        Target time step. The default is None (coarsest resolution).
+    to_utc : bool, optional
+        Moves every series to UTC. The default is True.
+    fold_years : bool, optional
+        Folds historic series too, averaging their years, so they can be
+        compared with typical years. The default is False (real years kept).
+
+    Returns
+    -------
+    dict
+        Source label as key and aligned series as value.
+
+    """
+    series = {label: df for label, df in series.items() if df is not None}
+    if not series:
+        return {}
+    if resolution is None:
+        resolution = common_resolution(series)
+    resolution = pd.Timedelta(resolution)
+    aligned = {}
+    for label, df_series in series.items():
+        df_aligned = df_series
+        if to_utc:
+            df_aligned = df_aligned.set_axis(df_aligned.index
+                - pd.Timedelta(hours=utc_offset(df_series, lon)), axis=0)
+        if fold_years or df_series.attrs.get(TYPICAL_YEAR, False):
+            #After the UTC shift, so hours crossing the new year wrap around
+            df_aligned = fold_to_typical_year(df_aligned)
+        df_aligned = resample_interval_average(df_aligned, resolution)
+        df_aligned.attrs["utc_offset"] = 0.0 if to_utc else df_series.attrs.get("utc_offset")
+        aligned[label] = df_aligned
+    return aligned
+
+def fold_to_typical_year(df_series: pd.DataFrame, year: int = TMY_YEAR):
+    """
+    Moves a series onto a single nominal (non leap) year. 29 February is
+    dropped, so every typical year has 365 days, and time stamps repeated
+    over several years are averaged.
+    """
+    index = df_series.index
+    df_folded = df_series[~((index.month == 2) & (index.day == 29))]
+    index = df_folded.index
+    df_folded = df_folded.set_axis(build_datetime_index(year, index.month.values,
+        index.day.values, index.hour.values, index.minute.values, index.second.values), axis=0)
+    if df_folded.index.is_unique:
+        df_folded = df_folded.sort_index()
+    else:
+        df_folded = df_folded.groupby(level=0).mean()
+    df_folded.attrs.update(df_series.attrs)
+    return df_folded
+
+def resample_interval_average(df_series: pd.DataFrame, resolution: pd.Timedelta):
+    """
+    Interval average resampling of a series (interval start index).
+    Finer grids repeat the interval average, coarser grids average the
+    intervals they contain. Non multiple steps go through their common divisor.
+    """
+    if not df_series.index.is_monotonic_increasing:
+        #e.g. typical years built from months of different years
+        df_series = df_series.sort_index()
+    source = detect_resolution(df_series.index).value
+    target = pd.Timedelta(resolution).value
+    step = math.gcd(source, target)
+    if step < source:
+        start = df_series.index[0]
+        fine_index = pd.date_range(start, df_series.index[-1] + pd.Timedelta(source - step),
+            freq=pd.Timedelta(step))
+        df_series = df_series.reindex(fine_index, method="ffill",
+            limit=source//step - 1)
+    if step < target:
+        df_series = df_series.resample(pd.Timedelta(target), closed="left",
+            label="left").mean()
+    return df_series
+
+def _nanoseconds(index: pd.DatetimeIndex):
+    #Whatever the unit of the index (pandas 2+ is not always ns)
+    return np.asarray(index.values.astype("datetime64[ns]")).view(np.int64)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Shared memory transport of parsed time series between processes.
+
+Producers copy a series once into a shared memory block and send its handle
+(a small dict) through a multiprocessing queue. Consumers rebuild the series
+as NumPy views over the block, without copying or pickling the data.
+
+Block layout: int64 index (ns since epoch) followed by the float64 values,
+one contiguous column after another.
+
+Platforms: on POSIX a block lives until it is unlinked, so the producer
+closes its mapping as soon as the block is filled. On Windows a block is
+destroyed with its last open mapping, so the producer keeps it open until
+the consumer has attached it (see handed_over and wait_handover).
+"""
+import os
+import logging
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import pandas as pd
+
+#Blocks outlive their mappings only on POSIX, elsewhere they are kept open until handed over
+PERSISTENT_BLOCKS = os.name == "posix"
+HANDOVER_TIMEOUT = 60
+_PUBLISHED_BLOCKS = {}
+
+def start_resource_tracker():
+    """
+    Starts the shared memory resource tracker in the main process. Must be
+    called before any subprocess is created: subprocesses then share it, and
+    blocks are not unlinked when the process that created or attached them
+    exits, only when the main process does (if still leaked).
+    There is no resource tracker (nor need of it) on Windows.
+    """
+    if PERSISTENT_BLOCKS:
+        resource_tracker.ensure_running()
+
+def publish_series(df_series: pd.DataFrame):
+    """
+    Copies a time series into a new shared memory block.
+
+    Parameters
+    ----------
+    df_series : pd.DataFrame
+        Numeric time series with a datetime index.
+
+    Returns
+    -------
+    dict
+        Block handle to be sent to the consumer, which becomes its owner.
+
+    """
+    def fill(index, values):
+        index[:] = pd.DatetimeIndex(df_series.index).values.astype("datetime64[ns]").view(np.int64)
+        for i, column in enumerate(df_series.columns):
+            values[i] = df_series[column].to_numpy(dtype=np.float64)
+    return publish_arrays(len(df_series), [str(column) for column in df_series.columns],
+        fill, df_series.index.name, dict(df_series.attrs))
+
+def publish_arrays(rows: int, columns: list, fill, index_name: str = None,
+                   attrs: dict = None):
+    """
+    Creates a shared memory block for a series and lets the producer fill it
+    in place (e.g. reading straight from a file), without intermediate copies.
+
+    Parameters
+    ----------
+    rows : int
+        Number of time stamps.
+    columns : list
+        Column names.
+    fill : callable
+        Called with the index (int64 ns, rows) and values (float64, columns x rows)
+        arrays mapped on the block.
+    index_name : str, optional
+        Name of the index. The default is None.
+    attrs : dict, optional
+        Series attributes. The default is None.
+
+    Returns
+    -------
+    dict
+        Block handle to be sent to the consumer, which becomes its owner.
+
+    """
+    block = shared_memory.SharedMemory(create=True,
+        size=max(1, 8*rows*(len(columns) + 1)))
+    try:
+        index, values = _block_arrays(block, rows, len(columns))
+        fill(index, values)
+        del index, values
+        handle = {"name": block.name, "rows": rows, "columns": list(columns),
+            "index_name": index_name, "attrs": dict(attrs or {})}
+    except Exception:
+        block.close()
+        block.unlink()
+        raise
+    if PERSISTENT_BLOCKS:
+        #Only the mapping is closed, the block lives until the consumer unlinks it
+        block.close()
+    else:
+        _PUBLISHED_BLOCKS[block.name] = block
+    return handle
+
+def handed_over(handle: dict):
+    """
+    Closes the producer mapping of a block once the consumer has attached it
+    (nothing left to close on POSIX).
+    """
+    block = _PUBLISHED_BLOCKS.pop(handle["name"], None)
+    if block is not None:
+        block.close()
+
+def wait_handover(handle: dict, acknowledged, timeout: float = HANDOVER_TIMEOUT):
+    """
+    Producer side of a handover to another process: waits until the consumer
+    sets the acknowledged event (multiprocessing.Event) before closing the
+    producer mapping. Returns immediately on POSIX.
+    """
+    if handle["name"] in _PUBLISHED_BLOCKS:
+        acknowledged.wait(timeout)
+    handed_over(handle)
+
+def attach_series(handle: dict):
+    """
+    Rebuilds a time series from a block handle without copying its values.
+
+    Returns
+    -------
+    tuple
+        Time series (views over the block) and the SharedMemory object,
+        which must be kept alive while the series is in use.
+
+    """
+    block = shared_memory.SharedMemory(name=handle["name"])
+    index, values = _block_arrays(block, handle["rows"], len(handle["columns"]))
+    df_series = pd.DataFrame(values.T, columns=handle["columns"], copy=False,
+        index=pd.DatetimeIndex(index.view("datetime64[ns]"), name=handle["index_name"]))
+    df_series.attrs.update(handle["attrs"])
+    #Blocks published by this same process no longer need the producer mapping
+    handed_over(handle)
+    return df_series, block
+
+def release_block(block: shared_memory.SharedMemory, unlink: bool = True):
+    """
+    Closes the mapping of a block and, for its owner, frees it.
+    """
+    try:
+        block.close()
+    except BufferError:
+        #Views still alive somewhere, memory is freed when they are collected
+        pass
+    if unlink:
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+def release_handle(handle: dict):
+    """
+    Frees a block that was published but never attached (e.g. discarded result).
+    """
+    try:
+        block = shared_memory.SharedMemory(name=handle["name"])
+    except FileNotFoundError:
+        handed_over(handle)
+        return
+    handed_over(handle)
+    release_block(block)
+
+class SharedSeriesRegistry:
+    """
+    Series attached in the consumer process, one shared block per key
+    (e.g. resource slot). Blocks are released when the key is replaced,
+    reset or the registry is cleared.
+    """
+    def __init__(self, logger: logging.Logger):
+        self.logger = logger
+        self.blocks = {}
+
+    def attach(self, key, handle: dict):
+        self.release(key)
+        df_series, block = attach_series(handle)
+        self.blocks[key] = (handle, block)
+        return df_series
+
+    def handle(self, key):
+        if key in self.blocks:
+            return self.blocks[key][0]
+        return None
+
+    def release(self, key):
+        if key in self.blocks:
+            handle, block = self.blocks.pop(key)
+            release_block(block)
+            self.logger.info("Shared memory block %s released", handle["name"])
+
+    def release_all(self):
+        for key in list(self.blocks.keys()):
+            self.release(key)
+
+def _block_arrays(block, rows, number_columns):
+    index = np.ndarray((rows,), dtype=np.int64, buffer=block.buf)
+    values = np.ndarray((number_columns, rows), dtype=np.float64, buffer=block.buf,
+        offset=8*rows)
+    return index, values
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Resource uncertainty module: exceedance probabilities (P50, P75, P90...)
+combining the spread between sources, the inter-annual variability of
+historic series and user defined uncertainty terms.
+
+All uncertainties are relative (standard deviation / mean).
+"""
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+import erya_timegrid as eryaT
+
+P_LEVELS = (50, 75, 90, 99)
+MONTE_CARLO_DRAWS = 100000
+MIN_MONTH_COVERAGE = 0.9
+MONTHS = ["January", "February", "March", "April", "May", "June", "July",
+    "August", "September", "October", "November", "December"]
+
+def exceedance_probabilities(monthly: dict, historic: list = None, terms: dict = None,
+        variable: str = "GHI", years: int = 1, method: str = "analytical",
+        draws: int = MONTE_CARLO_DRAWS, seed: int = None, levels: tuple = P_LEVELS):
+    """
+    Monthly and annual values exceeded with the requested probabilities.
+
+    Parameters
+    ----------
+    monthly : dict
+        Source label as key and monthly averages dataframe as value. Their
+        mean is the P50 and their spread the source uncertainty.
+    historic : list, optional
+        Historic time series used for the inter-annual variability. The default is None.
+    terms : dict, optional
+        Additional uncertainty terms, name as key and relative standard
+        deviation as value (e.g. {"measurement": 0.03}). The default is None.
+    variable : str, optional
+        Column analysed. The default is "GHI".
+    years : int, optional
+        Averaging horizon in years, inter-annual variability decreases with it.
+        The default is 1.
+    method : str, optional
+        "analytical" (normal combination) or "montecarlo". The default is "analytical".
+    draws : int, optional
+        Monte Carlo draws. The default is MONTE_CARLO_DRAWS.
+    seed : int, optional
+        Monte Carlo random seed. The default is None.
+    levels : tuple, optional
+        Exceedance probabilities (%). The default is P_LEVELS.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per month plus "Year", one column per level ("P50", "P90"...).
+
+    """
+    df_sources = _monthly_table(monthly, variable)
+    p50 = df_sources.mean(axis=1).to_numpy()
+    source_sigma = _relative_std(df_sources.to_numpy())
+    terms_sigma = np.array(list((terms or {}).values()), dtype=float)
+    anomalies = interannual_anomalies(historic or [], variable)
+
+    if method == "analytical":
+        values = _analytical(p50, df_sources.sum(axis=0).to_numpy(), source_sigma,
+            terms_sigma, anomalies, years, levels)
+    elif method == "montecarlo":
+        values = _monte_carlo(p50, _source_deviations(df_sources.to_numpy()), terms_sigma,
+            anomalies, years, levels, draws, seed)
+    else:
+        raise ValueError("Unknown uncertainty method "+str(method))
+    return pd.DataFrame(values, index=MONTHS+["Year"],
+        columns=["P"+str(level) for level in levels])
+
+def interannual_anomalies(historic: list, variable: str = "GHI"):
+    """
+    Relative monthly values of every complete year of the historic series.
+
+    Returns
+    -------
+    np.ndarray
+        (years, 12) array, value of each year and month over the mean of the month.
+
+    """
+    rows = []
+    for df_series in historic:
+        if (df_series is None) or (variable not in df_series.columns):
+            continue
+        step_hours = eryaT.detect_resolution(df_series.index)/pd.Timedelta(hours=1)
+        grouped = df_series[variable].groupby([df_series.index.year, df_series.index.month])
+        #Months with missing data would bias the anomalies, incomplete years are dropped
+        df_months = pd.DataFrame({"sum": grouped.sum()*step_hours,
+            "count": grouped.count()*step_hours})
+        years, months = df_months.index.get_level_values(0), df_months.index.get_level_values(1)
+        hours = pd.to_datetime({"year": years, "month": months, "day": 1}).dt.days_in_month*24
+        df_months = df_months[df_months["count"].to_numpy() >= MIN_MONTH_COVERAGE*hours.to_numpy()]
+        #Every month is kept as a column, a month never complete drops every year
+        df_years = df_months["sum"].unstack().reindex(columns=range(1, 13))
+        rows.append(df_years.dropna().to_numpy())
+    if not rows:
+        return np.ones((0, 12))
+    table = np.vstack(rows)
+    if len(table) < 2:
+        return np.ones((0, 12))
+    return table/table.mean(axis=0)
+
+def _monthly_table(monthly, variable):
+    df_sources = pd.DataFrame({label: pd.to_numeric(df_ma[variable], errors="coerce")
+        for label, df_ma in monthly.items()})
+    return df_sources.reindex(MONTHS)
+
+def _relative_std(values):
+    #Relative spread of each row, nothing can be said with a single value
+    if values.shape[1] < 2:
+        return np.zeros(values.shape[0])
+    return np.nanstd(values, axis=1, ddof=1)/np.nanmean(values, axis=1)
+
+def _source_deviations(values):
+    #Relative deviation of each source from the mean profile, scaled so that
+    #deviations @ N(0, 1) has the sample covariance of the sources (12, sources)
+    if values.shape[1] < 2:
+        return np.zeros((values.shape[0], 0))
+    relative = values/np.nanmean(values, axis=1, keepdims=True) - 1
+    return np.nan_to_num(relative)/np.sqrt(values.shape[1] - 1)
+
+def _analytical(p50, annual_sources, source_sigma, terms_sigma, anomalies, years, levels):
+    annual_source_sigma = _relative_std(annual_sources[np.newaxis, :])[0]
+    if len(anomalies) > 1:
+        iav_sigma = anomalies.std(axis=0, ddof=1)/np.sqrt(years)
+        annual = (anomalies*p50).sum(axis=1)
+        annual_iav_sigma = annual.std(ddof=1)/annual.mean()/np.sqrt(years)
+    else:
+        iav_sigma, annual_iav_sigma = np.zeros(12), 0.0
+    terms = np.sum(terms_sigma**2)
+    sigma = np.sqrt(source_sigma**2 + terms + iav_sigma**2)
+    annual_sigma = np.sqrt(annual_source_sigma**2 + terms + annual_iav_sigma**2)
+
+    p50 = np.append(p50, p50.sum())
+    sigma = np.append(sigma, annual_sigma)
+    #Value exceeded with probability p: quantile 1-p of the normal distribution
+    z = np.array([NormalDist().inv_cdf(level/100) for level in levels])
+    return p50[:, np.newaxis]*(1 - sigma[:, np.newaxis]*z[np.newaxis, :])
+
+def _monte_carlo(p50, source_deviations, terms_sigma, anomalies, years, levels, draws, seed):
+    rng = np.random.default_rng(seed)
+    #Sources keep their monthly structure, differences between them may cancel over the year
+    source_normal = rng.standard_normal((source_deviations.shape[1], draws))
+    #Long term terms affect every month of a draw in the same way
+    terms_normal = rng.standard_normal((len(terms_sigma), draws))
+    factor = (1 + (source_deviations @ source_normal).T) * \
+        (1 + (terms_sigma @ terms_normal))[:, np.newaxis]
+    if len(anomalies) > 1:
+        #Whole historic years are resampled, keeping the correlation between months
+        weather = np.zeros((draws, 12))
+        for _ in range(years):
+            weather += anomalies[rng.integers(0, len(anomalies), draws)]
+        factor = factor*weather/years
+    values = factor*p50[np.newaxis, :]
+    values = np.hstack([values, values.sum(axis=1, keepdims=True)])
+    return np.percentile(values, [100 - level for level in levels], axis=0).T